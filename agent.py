@@ -3,56 +3,174 @@
 """ File Description
 
     This module wires together three protocols into a single “analysis” agent that listens for incoming token‑analysis 
-    requests, enforces rate limits, parses user commands (buy, sell, analyze), fetches on‑chain data via Bitquery when asked 
-    to analyze, invokes the ASI‑1 LLM for deep memecoin insights, and then replies with either an AnalysisResponse or an 
-    ErrorMessage. It does the following in sequence: (1) instantiates a base Agent, (2) applies a QuotaProtocol to throttle 
-    to 30 requests/hour, (3) handles TokenRequest messages by extracting the intent, (4) if the intent is “analyze” it 
-    retrieves token metrics and AI analysis, (5) logs each step, and (6) includes the chat and structured‑output protocols 
-    before running the agent.
+    requests, enforces per-sender rate limits, parses user commands (trades are refused there), fetches on‑chain data via
+    Bitquery when asked to analyze, invokes the ASI‑1 LLM for deep memecoin insights, and then replies with either an
+    AnalysisResponse or an ErrorMessage. It does the following in sequence: (1) instantiates a base Agent, (2) limits
+    each sender to 30 requests/hour with an in-memory token bucket that is saved to agent storage periodically,
+    (3) handles TokenRequest messages by extracting the intent, (4) if the intent is “analyze” it retrieves token
+    metrics and AI analysis, (5) logs each step, (6) scans the senders' watchlists on a timer and alerts them when a
+    watched token crosses a threshold, and (7) includes the chat and structured‑output protocols before running the
+    agent.
 """
 
 # import neccesary dependencies
-from uagents import Agent, Context, Model
-from uagents.experimental.quota import QuotaProtocol, RateLimit
+import json
+from uagents import Agent, Context, Model, Protocol
 from uagents_core.models import ErrorMessage
 from query import TokenRequest, AnalysisResponse, get_memecoin_info_from_address
-from chat import chat_proto, struct_output_client_proto, get_analysis_from_agent
+from chat import chat_proto, struct_output_client_proto, get_analysis_from_agent, send_watchlist_alerts
+from helpers import extract_prompt, analysis_cache
+from command_parser import parse_command
+from http_client import close_all, UPSTREAMS
+from ratelimit import sender_limiter, RATE_LIMIT_PERSIST_INTERVAL
+import trade_stream
+from orders import order_pipeline
+from scheduler import scheduler
+from watchlist import watchlist, WATCHLIST_INTERVAL
+from workers import worker_pool
+import query
+import metrics
 
 # new agent instance
 analysis_agent = Agent()
 
-proto = QuotaProtocol(
-    storage_reference=analysis_agent.storage,
-    name="Solana-Wallet-Protocol",
-    version="0.1.0",
-    default_rate_limit=RateLimit(window_size_minutes=60, max_requests=30),
-)
+class MetricsResponse(Model):
+    metrics: dict
+
+class ProfilesResponse(Model):
+    profiles: list
+
+metrics.register_source("metrics_cache", query.metrics_cache.stats)
+metrics.register_source("analysis_cache", analysis_cache.stats)
+metrics.register_source("scheduler", scheduler.stats)
+metrics.register_source("orders", order_pipeline.stats)
+metrics.register_source("rate_limits", lambda: dict(
+    sender_limiter.stats(),
+    **{name: upstream.budget.stats() for name, upstream in UPSTREAMS.items() if upstream.budget is not None},
+))
+metrics.register_source("watchlist", watchlist.stats)
+if worker_pool is not None:
+    metrics.register_source("workers", worker_pool.stats)
+if trade_stream.ingestor is not None:
+    metrics.register_source("trade_stream", trade_stream.ingestor.stats)
+metrics.register_source("circuits", lambda: {name: upstream.breaker.stats() for name, upstream in UPSTREAMS.items()})
+
+proto = Protocol(name="Solana-Wallet-Protocol", version="0.1.0")
 
 @proto.on_message(
     TokenRequest, replies={AnalysisResponse, ErrorMessage}
 )
 async def handle_request(ctx: Context, sender: str, msg: TokenRequest):
     ctx.logger.info(f"Received token analysis request for CA: {msg.prompt}")
+    if not sender_limiter.allow(sender):
+        await ctx.send(sender, ErrorMessage(error=(
+            f"Rate limit exceeded for TokenRequest. This handler allows for {sender_limiter.max_requests} calls per "
+            f"{sender_limiter.window_minutes:g} minutes. Try again in {sender_limiter.retry_after(sender):.0f} seconds."
+        )))
+        return
     try:
-        command = extract_prompt(msg.prompt)
-        data = json.loads(command)
-
-        if data["type"] == "buy" | data["type"] == "sell":
-            ##
-            ctx.logger(data["type"])
-        elif data["type"] == "analyze":
-            info = await get_memecoin_info_from_address(msg.contract_address)
+        data = parse_command(msg.prompt)
+        if data is None:
+            command = await extract_prompt(msg.prompt)
+            data = json.loads(command["choices"][0]["message"]["content"])
+
+        # TokenRequest is an analysis endpoint open to any agent, orders are only placed over the chat protocol
+        if data["type"] == "buy" or data["type"] == "sell":
+            raise ValueError("TokenRequest only supports token analysis, trades can be placed over the chat protocol")
+        elif data["type"] in ("analysis", "analyze"):
+            info = await get_memecoin_info_from_address(data["address"])
             analysis = await get_analysis_from_agent(info)
+            final_analysis = analysis["choices"][0]["message"]["content"]
+            ctx.logger.info(f"Analysis for memecoin with CA {data['address']} completed")
         else:
-            ctx.logger("I was unable to extract a valid command from your input")
-        
-        final_analysis = analysis["choices"][0]["message"]["content"]
-        ctx.logger.info(f"Analysis for memecoin with CA {msg.contract_address} completed")
+            raise ValueError("I was unable to extract a valid command from your input")
+
         await ctx.send(sender, AnalysisResponse(analysis=final_analysis))
     except Exception as err:
         ctx.logger.error(err)
         await ctx.send(sender, ErrorMessage(error=str(err)))
 
+# sender rate limits live in memory; storage only sees a periodic snapshot so they survive restarts
+@analysis_agent.on_event("startup")
+async def restore_rate_limits(ctx: Context):
+    sender_limiter.restore(ctx.storage)
+
+@analysis_agent.on_interval(period=RATE_LIMIT_PERSIST_INTERVAL)
+async def persist_rate_limits(ctx: Context):
+    sender_limiter.persist(ctx.storage)
+
+# watchlists are kept in memory like the rate limits and saved whenever they changed
+@analysis_agent.on_event("startup")
+async def restore_watchlists(ctx: Context):
+    watchlist.restore(ctx.storage)
+
+# refresh every watched mint in batched queries and alert the watchers of the ones that crossed a threshold
+@analysis_agent.on_interval(period=WATCHLIST_INTERVAL)
+async def scan_watchlists(ctx: Context):
+    watchlist.persist(ctx.storage)
+    triggered = await watchlist.refresh()
+    if triggered:
+        await send_watchlist_alerts(ctx, triggered)
+
+# in multi-process mode analyses and trades are handed to worker processes sharded by mint
+@analysis_agent.on_event("startup")
+async def start_workers(ctx: Context):
+    if worker_pool is not None:
+        worker_pool.start()
+        ctx.logger.info(f"Started {len(worker_pool.workers)} worker processes")
+
+# start consuming the trade stream when streaming metrics are enabled
+@analysis_agent.on_event("startup")
+async def start_trade_stream(ctx: Context):
+    if trade_stream.ingestor is not None:
+        trade_stream.ingestor.start()
+        ctx.logger.info(f"Trade stream ingestion started ({trade_stream.TRADE_STREAM_MODE})")
+
+# stop streaming trades for mints nobody has asked about in a while
+if trade_stream.ingestor is not None:
+    @analysis_agent.on_interval(period=60.0)
+    async def evict_idle_streams(ctx: Context):
+        trade_stream.ingestor.evict_idle()
+
+# start the order workers and open the PumpPortal connection before the first trade comes in
+@analysis_agent.on_event("startup")
+async def start_order_pipeline(ctx: Context):
+    order_pipeline.start()
+    await order_pipeline.warm()
+
+# keep the pooled PumpPortal connection from idling out between trades
+@analysis_agent.on_interval(period=45.0)
+async def keep_order_connection_warm(ctx: Context):
+    await order_pipeline.warm()
+
+# latency percentiles, counters and queue/cache stats for the whole pipeline
+@analysis_agent.on_rest_get("/metrics", MetricsResponse)
+async def get_metrics(ctx: Context) -> MetricsResponse:
+    return MetricsResponse(metrics=metrics.snapshot())
+
+# cProfile output of the sampled requests slower than PROFILE_SLOW_MS
+@analysis_agent.on_rest_get("/profiles", ProfilesResponse)
+async def get_profiles(ctx: Context) -> ProfilesResponse:
+    return ProfilesResponse(profiles=metrics.profiles())
+
+if metrics.METRICS_DUMP_INTERVAL > 0:
+    @analysis_agent.on_interval(period=metrics.METRICS_DUMP_INTERVAL)
+    async def dump_metrics(ctx: Context):
+        ctx.logger.info(f"Metrics: {json.dumps(metrics.snapshot(), default=str)}")
+
+# release the pooled upstream connections when the agent stops
+@analysis_agent.on_event("shutdown")
+async def close_upstreams(ctx: Context):
+    sender_limiter.persist(ctx.storage)
+    watchlist.persist(ctx.storage)
+    if trade_stream.ingestor is not None:
+        await trade_stream.ingestor.stop()
+    await scheduler.stop()
+    if worker_pool is not None:
+        await worker_pool.stop()
+    await order_pipeline.stop()
+    await close_all()
+
 analysis_agent.include(proto, publish_manifest=True)
 analysis_agent.include(chat_proto, publish_manifest=True)
 analysis_agent.include(struct_output_client_proto, publish_manifest=True)
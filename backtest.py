@@ -0,0 +1,228 @@
+"""File Description
+
+    This is the offline backtester for the scoring and trade decision logic. It replays the raw trades kept in the
+    metrics store (store.py, filled by the multi-window fetch mode) for any number of mints: at every decision step it
+    computes the metrics window the agent would have seen (all steps at once, windows.sliding_metrics), scores it with
+    the same features.score the agent uses, and trades on the score. A position is opened when the score reaches
+    --buy-score and closed when it drops to --sell-score, on take-profit, stop-loss or after --max-hold minutes.
+    Fills happen at the first trade after --latency seconds; an order whose fill is further from the decision price
+    than the --slippage tolerance (the same percent PumpPortal gets from execute_command) is rejected like on-chain,
+    and accepted fills pay --impact and --fee percent per side plus the priority fee. Mints are spread over a process
+    pool and every combination of the comma-separated parameter values is evaluated, so parameter sweeps over weeks
+    of history stay array-at-a-time.
+
+    Usage:
+        python backtest.py --store data --days 30
+        python backtest.py --store data --window 5,15,30 --buy-score 7,8,9 --slippage 5,10 --workers 8
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from features import RAW_FIELDS, score
+from store import TokenStore
+from windows import sliding_metrics
+
+# parameters that can be swept with comma-separated values, and their defaults
+SWEEP_PARAMS = {
+    "window": "15",  # minutes of trades behind each score, the agent uses 15
+    "buy_score": "8",
+    "sell_score": "4",
+    "take_profit": "50",  # percent
+    "stop_loss": "20",  # percent
+    "max_hold": "60",  # minutes
+    "slippage": "10",  # percent tolerance, as sent to PumpPortal
+}
+
+
+def _grid(args) -> list:
+    values = [[float(value) for value in str(getattr(args, name)).split(",")] for name in SWEEP_PARAMS]
+    return [dict(zip(SWEEP_PARAMS, combination)) for combination in itertools.product(*values)]
+
+
+def _scores(columns: dict, ends: np.ndarray, window_minutes: float) -> np.ndarray:
+    metrics = sliding_metrics(columns, ends, window_minutes * 60)
+    raw = np.column_stack([np.asarray(metrics[name], dtype=np.float64) for name in RAW_FIELDS])
+    return score(raw)
+
+
+def simulate(scores: np.ndarray, ends: np.ndarray, price: np.ndarray, fill_price: np.ndarray, params: dict,
+             costs: dict) -> dict:
+    """
+    Trade one mint on its score series
+
+    Args:
+        scores: score at every decision time
+        ends: decision times
+        price: last trade price at every decision time (what the agent saw)
+        fill_price: price of the first trade after the decision plus latency, nan when there was none
+        params: one combination of SWEEP_PARAMS
+        costs: "impact" and "fee" fractions per side, "priority" fee as a fraction of the position
+
+    Returns:
+        trades, wins, rejected orders and the per-trade net returns
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        move = fill_price / price - 1
+    tolerance = params["slippage"] / 100
+    buy_ok = np.isfinite(move) & (price > 0) & (move <= tolerance)
+    sell_ok = np.isfinite(move) & (price > 0) & (-move <= tolerance)
+    signals = (scores >= params["buy_score"]) & (price > 0)
+    entries = signals & buy_ok
+
+    returns = []
+    rejected = 0
+    k = 0
+    while k < len(scores):
+        pending = entries[k:]
+        if not pending.any():
+            rejected += int((signals[k:] & ~buy_ok[k:]).sum())
+            break
+        entry = k + int(np.argmax(pending))
+        rejected += int((signals[k:entry] & ~buy_ok[k:entry]).sum())
+        entry_price = fill_price[entry] * (1 + costs["impact"])
+
+        after = slice(entry + 1, len(scores))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mark = price[after] / fill_price[entry] - 1
+        wanted = (
+            (scores[after] <= params["sell_score"])
+            | (mark >= params["take_profit"] / 100)
+            | (mark <= -params["stop_loss"] / 100)
+            | (ends[after] - ends[entry] >= params["max_hold"] * 60)
+        )
+        blocked = wanted & ~sell_ok[after]
+        exits = wanted & sell_ok[after]
+        if exits.any():
+            exit_at = entry + 1 + int(np.argmax(exits))
+            rejected += int(blocked[:exit_at - entry - 1].sum())
+            exit_price = fill_price[exit_at] * (1 - costs["impact"])
+        else:
+            # still open at the end of the data, marked to the last price
+            exit_at = len(scores)
+            rejected += int(blocked.sum())
+            exit_price = price[-1] * (1 - costs["impact"])
+
+        returns.append(exit_price / entry_price * (1 - costs["fee"]) / (1 + costs["fee"]) - 1 - 2 * costs["priority"])
+        k = exit_at + 1
+
+    returns = np.asarray(returns)
+    return {"trades": len(returns), "wins": int((returns > 0).sum()), "rejected": rejected, "returns": returns}
+
+
+def backtest_mint(job: tuple) -> list:
+    """Run every parameter combination on one mint (process pool entry point); returns one stats dict per combination"""
+    store_dir, mint, start, end, grid, costs, step, latency = job
+    token_store = TokenStore(store_dir)
+    columns = token_store.trade_columns(mint, start, end)
+    priced = columns["price"] > 0
+    columns = {name: np.asarray(column)[priced] for name, column in columns.items()}
+    times = columns["time"]
+    results = []
+    if len(times) < 2:
+        return [{"trades": 0, "wins": 0, "rejected": 0, "return_sum": 0.0, "compounded": 0.0} for _ in grid]
+
+    ends = np.arange(times[0] + step, times[-1], step)
+    last_trade = np.searchsorted(times, ends, side="right") - 1
+    price = columns["price"][last_trade]
+    fill_index = np.searchsorted(times, ends + latency, side="left")
+    fill_price = np.where(fill_index < len(times), columns["price"][np.minimum(fill_index, len(times) - 1)], np.nan)
+
+    scores_by_window = {}
+    for params in grid:
+        if params["window"] not in scores_by_window:
+            scores_by_window[params["window"]] = _scores(columns, ends, params["window"])
+        outcome = simulate(scores_by_window[params["window"]], ends, price, fill_price, params, costs)
+        results.append({
+            "trades": outcome["trades"],
+            "wins": outcome["wins"],
+            "rejected": outcome["rejected"],
+            "return_sum": float(outcome["returns"].sum()),
+            "compounded": float(np.prod(1 + outcome["returns"]) - 1),
+        })
+    return results
+
+
+def run(args) -> list:
+    token_store = TokenStore(args.store)
+    mints = args.mints.split(",") if args.mints else token_store.trades.mints()
+    end = time.time() if args.end is None else args.end
+    start = end - args.days * 24 * 60 * 60
+    grid = _grid(args)
+    costs = {"impact": args.impact / 100, "fee": args.fee / 100, "priority": args.priority_fee / args.position_sol}
+    jobs = [(args.store, mint, start, end, grid, costs, args.step, args.latency) for mint in mints]
+
+    workers = args.workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        per_mint = list(pool.map(backtest_mint, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+    report = []
+    for index, params in enumerate(grid):
+        rows = [results[index] for results in per_mint]
+        trades = sum(row["trades"] for row in rows)
+        report.append({
+            **params,
+            "mints": len(rows),
+            "trades": trades,
+            "win_rate": sum(row["wins"] for row in rows) / trades if trades else None,
+            "mean_return": sum(row["return_sum"] for row in rows) / trades if trades else None,
+            "mean_mint_return": sum(row["compounded"] for row in rows) / len(rows) if rows else None,
+            "rejected": sum(row["rejected"] for row in rows),
+        })
+    report.sort(key=lambda row: row["mean_return"] if row["mean_return"] is not None else -np.inf, reverse=True)
+    return report
+
+
+def format_report(report: list) -> str:
+    header = list(SWEEP_PARAMS) + ["trades", "win_rate", "mean_return", "mean_mint_return", "rejected"]
+    lines = ["  ".join(f"{name:>16}" for name in header)]
+    for row in report:
+        cells = []
+        for name in header:
+            value = row[name]
+            if value is None:
+                cells.append(f"{'-':>16}")
+            elif name in ("win_rate", "mean_return", "mean_mint_return"):
+                cells.append(f"{value:>+16.2%}" if name != "win_rate" else f"{value:>16.1%}")
+            else:
+                cells.append(f"{value:>16g}")
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay stored trades through the scoring and trade decision logic")
+    parser.add_argument("--store", default=os.getenv("STORE_DIR", ""), help="metrics store directory (STORE_DIR)")
+    parser.add_argument("--mints", default="", help="comma-separated mints, all stored mints by default")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--end", type=float, default=None, help="end of the replayed range, epoch seconds (default now)")
+    parser.add_argument("--step", type=float, default=60, help="seconds between decisions")
+    parser.add_argument("--latency", type=float, default=2, help="seconds from decision to fill")
+    for name, default in SWEEP_PARAMS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, default=default)
+    parser.add_argument("--impact", type=float, default=1.0, help="percent price impact per fill")
+    parser.add_argument("--fee", type=float, default=1.0, help="percent fee per side")
+    parser.add_argument("--priority-fee", type=float, default=0.0, help="SOL per transaction")
+    parser.add_argument("--position-sol", type=float, default=1.0, help="SOL per position")
+    parser.add_argument("--workers", type=int, default=0, help="processes, one per CPU by default")
+    parser.add_argument("--output", default="backtest_output.json")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.store:
+        raise SystemExit("No metrics store: pass --store or set STORE_DIR")
+    started = time.perf_counter()
+    report = run(args)
+    print(format_report(report))
+    print(f"{len(report)} parameter sets in {time.perf_counter() - started:.1f}s")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
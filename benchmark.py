@@ -0,0 +1,373 @@
+"""File Description
+
+    This is the offline load-test harness. It starts local stand-ins for the three upstreams (ASI-1 chat completions
+    including SSE streaming, Bitquery's DEXTradeByTokens GraphQL and PumpPortal's trade API) with configurable
+    latency, jitter and error rate, points the agent at them, and drives handle_message (chat protocol) or
+    handle_request (quota protocol, analysis only, so buys are left out of its mix) with many synthetic senders. It reports requests/sec and latency percentiles per
+    run, plus per-stage latencies from metrics.py, and can store a run as the baseline and compare later runs to it,
+    so every performance change can be measured without touching the real APIs.
+
+    Usage:
+        python benchmark.py --requests 500 --concurrency 50
+        python benchmark.py --protocol quota --asi1-latency 0.8 --error-rate 0.02
+        python benchmark.py --save-baseline          # store this run in bench_baseline.json
+        python benchmark.py --baseline bench_baseline.json
+"""
+
+import argparse
+import asyncio
+import builtins
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import base58
+from aiohttp import web
+
+# Agentverse injects the API keys as globals; outside of it the agent modules need stand-ins before they are imported
+for secret in ("AGENTVERSE_API_KEY", "BITQUERY_API_KEY", "PUMP_PORTAL_API_KEY"):
+    if not hasattr(builtins, secret):
+        setattr(builtins, secret, "benchmark")
+
+logger = logging.getLogger("benchmark")
+
+FAKE_ANALYSIS = "\n\n".join(
+    f"## {title}\n" + " ".join(["Plenty of emoji-rich memecoin commentary for this section 🚀📊."] * 6)
+    for title in ("Summary", "15m Price Action", "Volume & Liquidity", "Order Flow & Sentiment", "Technical Outlook",
+                  "Risk & Strategy")
+) + "\n\n**Scale In Now** Safety score: 6/10"
+
+
+class UpstreamProfile:
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+class FakeUpstreams:
+    """One local aiohttp server answering like ASI-1, Bitquery and PumpPortal"""
+
+    def __init__(self, asi1: UpstreamProfile, bitquery: UpstreamProfile, pumpportal: UpstreamProfile):
+        self.profiles = {"asi1": asi1, "bitquery": bitquery, "pumpportal": pumpportal}
+        self.calls = {name: 0 for name in self.profiles}
+        self.errors = {name: 0 for name in self.profiles}
+        self.base_url = None
+        self._runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.asi1)
+        app.router.add_post("/eap", self.bitquery)
+        app.router.add_post("/api/trade", self.pumpportal)
+        app.router.add_route("HEAD", "/", self.pumpportal_ping)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{bound_port}"
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _enter(self, name: str):
+        """Simulated latency, then True when this call should fail"""
+        self.calls[name] += 1
+        profile = self.profiles[name]
+        await profile.delay()
+        if profile.fails():
+            self.errors[name] += 1
+            return True
+        return False
+
+    async def asi1(self, request: web.Request):
+        body = await request.json()
+        if await self._enter("asi1"):
+            return web.json_response({"error": "simulated failure"}, status=500)
+
+        system, user = body["messages"][0]["content"], body["messages"][1]["content"]
+        if "transaction parser" in system:
+            # imitate the intent extractor: first address in the message, analysis unless a trade verb is present
+            from command_parser import find_addresses
+            addresses = find_addresses(user) or ["unknown"]
+            kind = "buy" if "buy" in user.lower() else "sell" if "sell" in user.lower() else "analysis"
+            content = json.dumps({"type": kind, "address": addresses[0], "amount": 0.01 if kind == "buy" else "none"})
+        else:
+            content = FAKE_ANALYSIS
+
+        if not body.get("stream"):
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for start in range(0, len(content), 40):
+            delta = {"choices": [{"delta": {"content": content[start:start + 40]}}]}
+            await response.write(f"data: {json.dumps(delta)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    @staticmethod
+    def _row(mint: str) -> dict:
+        # deterministic per mint so repeated runs see the same market
+        seed = int(hashlib.sha256(mint.encode()).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        start = rng.uniform(1e-6, 1e-3)
+        buyers, sellers = rng.randint(10, 400), rng.randint(10, 400)
+        buy_volume, sell_volume = rng.uniform(1e3, 5e5), rng.uniform(1e3, 5e5)
+        buys, sells = buyers * rng.randint(1, 4), sellers * rng.randint(1, 4)
+        return {
+            "Trade": {
+                "Currency": {"Name": f"Bench {mint[:4]}", "MintAddress": mint, "Symbol": mint[:4].upper()},
+                "start": start,
+                "end": start * rng.uniform(0.5, 2.0),
+            },
+            "makers_15min": str(buyers + sellers - rng.randint(0, min(buyers, sellers))),
+            "buyers_15min": str(buyers),
+            "sellers_15min": str(sellers),
+            "trades_15min": str(buys + sells),
+            "traded_volume_15min": str(buy_volume + sell_volume),
+            "buy_volume_15min": str(buy_volume),
+            "sell_volume_15min": str(sell_volume),
+            "buys_15min": str(buys),
+            "sells_15min": str(sells),
+            "price_15min_allTimeHigh": start * rng.uniform(1.0, 3.0),
+        }
+
+    async def bitquery(self, request: web.Request):
+        body = await request.json()
+        if await self._enter("bitquery"):
+            return web.json_response({"errors": [{"message": "simulated failure"}]}, status=500)
+        variables = body.get("variables", {})
+        mints = variables.get("tokens") or [variables.get("token")]
+        return web.json_response({"data": {"Solana": {"DEXTradeByTokens": [self._row(mint) for mint in mints]}}})
+
+    async def pumpportal(self, request: web.Request):
+        await request.post()
+        if await self._enter("pumpportal"):
+            return web.json_response({"signature": None, "errors": ["simulated failure"]}, status=500)
+        return web.json_response({"signature": base58.b58encode(os.urandom(64)).decode(), "errors": []})
+
+    async def pumpportal_ping(self, request: web.Request):
+        return web.Response()
+
+
+class BenchStorage(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+class BenchContext:
+    """Just enough of uagents' Context for the handlers: logger, storage, session and a recording send()"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.logger = logging.getLogger("benchmark.ctx")
+        self.storage = BenchStorage()
+        self.session = uuid4()
+
+    async def send(self, destination: str, message):
+        self.driver.delivered(destination, message)
+
+
+class LoadDriver:
+    def __init__(self, protocol: str, mints: list, mix: dict, timeout: float):
+        self.protocol = protocol
+        self.mints = mints
+        self.mix = mix
+        self.timeout = timeout
+        self.latencies = []
+        self.outcomes = {"ok": 0, "error": 0, "busy": 0, "timeout": 0}
+        self._waiting = {}
+
+    def message_text(self) -> str:
+        kind = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        mint = random.choice(self.mints)
+        if kind == "buy":
+            return f"buy 0.01 sol of {mint}"
+        if kind == "llm":
+            return f"hmm what do you reckon about {mint} right now"
+        return f"analyze {mint}"
+
+    def delivered(self, destination: str, message):
+        """Resolve the sender's pending request once its final reply is sent"""
+        from uagents_core.contrib.protocols.chat import ChatMessage, EndSessionContent
+        from uagents_core.models import ErrorMessage
+
+        waiter = self._waiting.get(destination)
+        if waiter is None or waiter.done():
+            return
+        if isinstance(message, ChatMessage):
+            if not any(isinstance(item, EndSessionContent) for item in message.content):
+                return
+            text = message.content[0].text
+            if text.startswith("I'm handling a lot of requests"):
+                waiter.set_result("busy")
+            elif text.startswith(("An error occurred", "Too many orders")):
+                waiter.set_result("error")
+            else:
+                waiter.set_result("ok")
+        elif isinstance(message, ErrorMessage):
+            waiter.set_result("busy" if "Rate limit" in message.error else "error")
+        elif type(message).__name__ == "AnalysisResponse":
+            waiter.set_result("ok")
+
+    async def one_request(self, sender: str):
+        from uagents_core.contrib.protocols.chat import ChatMessage, TextContent
+
+        ctx = BenchContext(self)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting[sender] = waiter
+        text = self.message_text()
+        start = time.perf_counter()
+
+        if self.protocol == "chat":
+            from chat import handle_message
+            message = ChatMessage(timestamp=datetime.utcnow(), msg_id=uuid4(), content=[TextContent(type="text", text=text)])
+            await handle_message(ctx, sender, message)
+        else:
+            from agent import handle_request
+            from query import TokenRequest
+            await handle_request(ctx, sender, TokenRequest(prompt=text))
+
+        try:
+            outcome = await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        finally:
+            self._waiting.pop(sender, None)
+        self.outcomes[outcome] += 1
+        if outcome == "ok":
+            self.latencies.append((time.perf_counter() - start) * 1000)
+
+    async def run(self, requests: int, concurrency: int) -> float:
+        counter = iter(range(requests))
+
+        async def worker(worker_id: int):
+            for sequence in counter:
+                await self.one_request(f"agent1bench{worker_id}x{sequence}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def _percentile(values: list, level: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(level * len(ordered)))]
+
+
+def compare(report: dict, baseline: dict) -> str:
+    lines = [f"{'metric':<10}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+        old, new = baseline.get(key), report.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        lines.append(f"{key:<10}{old:>12.1f}{new:>12.1f}{change:>+9.1f}%")
+    return "\n".join(lines)
+
+
+async def main(args):
+    random.seed(args.seed)
+    fakes = await FakeUpstreams(
+        asi1=UpstreamProfile(args.asi1_latency, args.jitter * args.asi1_latency, args.error_rate),
+        bitquery=UpstreamProfile(args.bitquery_latency, args.jitter * args.bitquery_latency, args.error_rate),
+        pumpportal=UpstreamProfile(args.pumpportal_latency, args.jitter * args.pumpportal_latency, args.error_rate),
+    ).start()
+
+    # endpoints are read when the agent modules are imported, so point them at the fakes first
+    os.environ["ASI1_ENDPOINT"] = f"{fakes.base_url}/v1/chat/completions"
+    os.environ["BITQUERY_ENDPOINT"] = f"{fakes.base_url}/eap"
+    os.environ["PUMPPORTAL_URL"] = fakes.base_url
+    import http_client
+    import metrics
+    if args.protocol == "quota":
+        import agent  # noqa: F401  (registers the quota protocol handler)
+    else:
+        import chat  # noqa: F401
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    mints = [base58.b58encode(random.Random(args.seed + i).randbytes(32)).decode() for i in range(args.mints)]
+    mix = {kind: float(weight) for kind, weight in (part.split("=") for part in args.mix.split(","))}
+    if args.protocol == "quota":
+        # TokenRequest does not place orders, only the analysis path is measured there
+        mix.pop("buy", None)
+    driver = LoadDriver(args.protocol, mints, mix, args.timeout)
+
+    try:
+        duration = await driver.run(args.requests, args.concurrency)
+    finally:
+        await http_client.close_all()
+        await fakes.stop()
+
+    snapshot = metrics.snapshot()
+    report = {
+        "protocol": args.protocol,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mints": args.mints,
+        "mix": mix,
+        "duration_s": duration,
+        "rps": args.requests / duration,
+        "p50_ms": _percentile(driver.latencies, 0.50),
+        "p95_ms": _percentile(driver.latencies, 0.95),
+        "p99_ms": _percentile(driver.latencies, 0.99),
+        "outcomes": driver.outcomes,
+        "upstream_calls": fakes.calls,
+        "upstream_errors": fakes.errors,
+        "stages": {stage: {"p50_ms": summary["p50_ms"], "p99_ms": summary["p99_ms"], "count": summary["count"]}
+                   for stage, summary in snapshot["latency"].items()},
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as stored:
+            print(compare(report, json.load(stored)))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as stored:
+            json.dump(report, stored, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the agent against local upstream stand-ins")
+    parser.add_argument("--protocol", choices=("chat", "quota"), default="chat")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--mints", type=int, default=40, help="distinct token addresses in the synthetic traffic")
+    parser.add_argument("--mix", default="analysis=0.6,llm=0.2,buy=0.2", help="weights of analysis / llm-parsed / buy messages")
+    parser.add_argument("--asi1-latency", type=float, default=0.3)
+    parser.add_argument("--bitquery-latency", type=float, default=0.15)
+    parser.add_argument("--pumpportal-latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency standard deviation as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="compare against this stored run if it exists")
+    parser.add_argument("--save-baseline", nargs="?", const="bench_baseline.json", default=None)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,177 @@
+"""File Description
+
+    This module holds the in-process caches used to avoid paying twice for the same upstream work. TTLCache is a
+    small LRU-bounded cache whose entries expire after a configurable time-to-live; get_or_fetch adds single-flight
+    coalescing on top of it, so when many chat users ask about the same trending mint at once only one upstream
+    request is sent and every caller shares its result. Hit, miss and coalesced counters are kept for monitoring.
+    AnalysisCache reuses finished LLM briefings while a token's metrics stay within configured tolerances.
+"""
+
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._inflight = {}  # key -> task fetching that key
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def inflight(self, key):
+        """Task currently fetching key through get_or_fetch, or None"""
+        return self._inflight.get(key)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get_or_fetch(self, key, fetch, should_cache=lambda value: value is not None):
+        """
+        Return the cached value for key, or run fetch() once and share it with every concurrent caller
+
+        Args:
+            key: cache key
+            fetch: zero-argument coroutine function producing the value
+            should_cache: predicate deciding whether a fetched value is stored (failed lookups are not)
+
+        Returns:
+            The cached or freshly fetched value
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+
+            def _done(finished, key=key):
+                self._inflight.pop(key, None)
+                if not finished.cancelled() and finished.exception() is None and should_cache(finished.result()):
+                    self.set(key, finished.result())
+
+            task.add_done_callback(_done)
+
+        # shield the shared fetch so one caller giving up does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+def _log_bucket(value, tolerance: float):
+    """Bucket index of value on a log scale where neighbouring buckets differ by `tolerance` (relative)"""
+    value = float(value or 0)
+    if value <= 0:
+        return None
+    return math.floor(math.log(value) / math.log1p(tolerance))
+
+
+class AnalysisCache:
+    """
+    Finished LLM briefings keyed by a quantized fingerprint of the token metrics they were generated from
+
+    Two metric snapshots share a fingerprint when price, volume and trade count fall in the same relative buckets
+    and the buyer/seller ratio rounds to the same step, i.e. when a new briefing would say the same thing.
+    """
+
+    def __init__(self, max_age: float, maxsize: int, price_tolerance: float, volume_tolerance: float,
+                 ratio_tolerance: float, stale_max_age: float = None):
+        self.price_tolerance = price_tolerance
+        self.volume_tolerance = volume_tolerance
+        self.ratio_tolerance = ratio_tolerance
+        self.entries = TTLCache(ttl=max_age, maxsize=maxsize)
+        # newest briefing per mint regardless of its metrics, served when the LLM budget is low
+        self.latest = TTLCache(ttl=stale_max_age if stale_max_age is not None else max_age, maxsize=maxsize)
+
+    def fingerprint(self, token_info: str):
+        """Quantized fingerprint of a Bitquery metrics response, or None when it holds no usable metrics"""
+        try:
+            row = json.loads(token_info)["data"]["Solana"]["DEXTradeByTokens"][0]
+            buyers = float(row.get("buyers_15min") or 0)
+            sellers = float(row.get("sellers_15min") or 0)
+            return (
+                row["Trade"]["Currency"]["MintAddress"],
+                _log_bucket(row["Trade"].get("end"), self.price_tolerance),
+                _log_bucket(row["Trade"].get("start"), self.price_tolerance),
+                _log_bucket(row.get("price_15min_allTimeHigh"), self.price_tolerance),
+                _log_bucket(row.get("traded_volume_15min"), self.volume_tolerance),
+                _log_bucket(row.get("trades_15min"), self.volume_tolerance),
+                round(buyers / max(sellers, 1) / self.ratio_tolerance),
+            )
+        except (TypeError, ValueError, KeyError, IndexError):
+            return None
+
+    def get(self, token_info: str):
+        key = self.fingerprint(token_info)
+        if key is None:
+            return None
+        analysis = self.entries.get(key)
+        if analysis is None:
+            self.entries.misses += 1
+            return None
+        self.entries.hits += 1
+        return dict(analysis, cached=True)
+
+    def set(self, token_info: str, analysis: dict):
+        key = self.fingerprint(token_info)
+        if key is not None:
+            self.entries.set(key, analysis)
+            self.latest.set(key[0], (time.time(), analysis))
+
+    def get_stale(self, token_info: str):
+        """Newest briefing for the token's mint even if its metrics moved since, or None"""
+        key = self.fingerprint(token_info)
+        entry = self.latest.get(key[0]) if key is not None else None
+        if entry is None:
+            return None
+        generated_at, analysis = entry
+        return dict(analysis, cached=True, stale=True, generated_at=generated_at)
+
+    def stats(self) -> dict:
+        return self.entries.stats()
@@ -6,10 +6,13 @@
 
 # library imports
 from datetime import datetime
+from functools import partial
 from uuid import uuid4
 from typing import Any
-import requests
+import os
+import time
 import json
+import asyncio
 from uagents import Context, Model, Protocol
 from uagents_core.contrib.protocols.chat import (
     ChatAcknowledgement,
@@ -19,8 +22,20 @@ from uagents_core.contrib.protocols.chat import (
     TextContent,
     chat_protocol_spec,
 )
-from query import get_memecoin_info_from_address, TokenRequest, AnalysisResponse
-from helpers import get_analysis_from_agent, extract_prompt, execute_command
+from query import get_memecoin_info_from_address, get_memecoin_info_for_addresses, TokenRequest, AnalysisResponse
+from helpers import (
+    get_analysis_from_agent, iter_analyses_from_agent, stream_analysis_from_agent, extract_prompt, execute_command,
+    STREAM_ANALYSIS, analysis_cache,
+)
+from command_parser import parse_command, find_addresses
+from features import summarize
+from orders import OrderOutcomeUnknown, OrderQueueFull
+from ratelimit import BudgetExhausted
+from resilience import UpstreamError
+import metrics
+from watchlist import watchlist, WatchlistFull, WATCHLIST_MAX_ANALYSES
+from scheduler import scheduler, SchedulerBusy, PRIORITY_TRADE, PRIORITY_PARSE, PRIORITY_ANALYSIS
+from workers import worker_pool, WorkerUnavailable
 
 # asi-1 LLM endpoint
 ASI1_Endpoint = "https://api.asi1.ai/v1/chat/completions"
@@ -31,6 +46,12 @@ headers = {
   'Authorization': f'Bearer {AGENTVERSE_API_KEY}'  # Replace with your agentverse API key
 }
 
+# most addresses speculatively fetched while the LLM parses a message, larger baskets wait for the batch query
+PREFETCH_LIMIT = int(os.getenv("PREFETCH_LIMIT", 3))
+
+# prefix on briefings reused from the analysis cache
+CACHED_NOTE = "♻️ _Metrics unchanged since a recent briefing, serving the cached analysis._\n\n"
+
 class Message(Model):
     message : str
     field : int
@@ -49,6 +70,29 @@ def create_text_chat(text: str, end_session: bool = True) -> ChatMessage:
         content=content,
     )
 
+async def timed_send(ctx: Context, destination: str, message: Model):
+    with metrics.span("ctx_send"):
+        await ctx.send(destination, message)
+
+def prefetch_token_info(text: str) -> list:
+    """
+    Start fetching Bitquery metrics for the candidate mint addresses in a message
+
+    The fetches go through the metrics cache, so a later get_memecoin_info_from_address for the same mint joins
+    the request already in flight instead of sending a new one.
+    """
+    # in multi-process mode the analysis is fetched by its worker, a prefetch here would only fetch it twice
+    if worker_pool is not None:
+        return []
+    addresses = find_addresses(text)
+    if not 0 < len(addresses) <= PREFETCH_LIMIT:
+        return []
+    tasks = [asyncio.ensure_future(get_memecoin_info_from_address(address)) for address in addresses]
+    for task in tasks:
+        # a failed prefetch is reported by the fetch that actually needs the data, not logged as never retrieved
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return tasks
+
 chat_proto = Protocol(spec=chat_protocol_spec)
 struct_output_client_proto = Protocol(
     name="StructuredOutputClientProtocol", version="0.1.0"
@@ -64,14 +108,18 @@ class StructuredOutputResponse(Model):
 # Handler for incoming ChatMessage instances on the chat_proto protocol
 @chat_proto.on_message(ChatMessage)
 async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
+    received_at = time.monotonic()
     # Log the receipt of the message along with the sender's address
     ctx.logger.info(f"Got a message from {sender}: {msg}")
     
     # Store the sender's address in the session storage using the session ID as the key
-    ctx.storage.set(str(ctx.session), sender)
+    # (every set is a write to disk, so only when it changed)
+    if ctx.storage.get(str(ctx.session)) != sender:
+        ctx.storage.set(str(ctx.session), sender)
     
     # Send an acknowledgment back to the sender to confirm receipt of the message
-    await ctx.send(
+    await timed_send(
+        ctx,
         sender,
         ChatAcknowledgement(
             timestamp=datetime.utcnow(),  # Current UTC time
@@ -80,7 +128,7 @@ async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
     )
 
     # Iterate through each content item in the received message, 1 in this case: text
-    for item in msg.content:
+    for index, item in enumerate(msg.content):
         # Check if the content item indicates the start of a new session
         if isinstance(item, StartSessionContent):
             # Log the initiation of a new session
@@ -91,49 +139,197 @@ async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
         elif isinstance(item, TextContent):
             # Log the received text message
             ctx.logger.info(f"Got 1 message from {sender}: {item.text}")
-            
-            # Store the sender's address again in the session storage (may be redundant)
-            ctx.storage.set(str(ctx.session), sender)
+            text = str(item.text)
+            # identifies this command across redeliveries of the same message
+            key = f"{sender}:{msg.msg_id}:{index}"
 
             try:
-                # function to extract command from user prompt on the frontend
-                # extracts commands from prompts in this form {"type": "buy", "address": "DezXAZ8z7PnrnRJjz3wXBoRgixCa6xjnB7YaB1pPB263", "amount": 0.0001}
-                command = await extract_prompt(str(item.text))
-                data = json.loads(command["choices"][0]["message"]["content"])
-                
-                #ctx.logger.info(f'{(command["choices"][0]["message"]["content"])}')
-
-                # prompt interpretation is resolved as a buy or sell order, execute order leveraging pumpportal API
-                if data["type"] == "buy" or data["type"] == "sell":
-                    resp = execute_command(f'{(command["choices"][0]["message"]["content"])}')
-                    # on failure
-                    if resp['errors'] != []:
-                        await ctx.send(sender, create_text_chat(f'{data["type"]} order for {data["address"]}, amount: {data["amount"]} failed with an error. /n Inspect for the error here: https://solscan.io/tx/{resp["signature"]}'))
-                    else:
-                        # on success return message and solscan tx link
-                        await ctx.send(sender, create_text_chat(f'{data["type"]} order for {data["address"]}, amount: {data["amount"]} executed successfully.   /n Transaction: https://solscan.io/tx/{resp["signature"]}'))
-                    
-                # if user prompts is interpreted by the LLM to indicate a memecoin analysis request:   
-                elif data["type"] == "analysis":
-                    # get coin data from bitquery api
-                    info = await get_memecoin_info_from_address(data["address"])
-                    # Our DegenAI gives its expert analysis and score
-                    analysis = await get_analysis_from_agent(info)
-                    final_analysis = analysis["choices"][0]["message"]["content"]
-                    ctx.logger.info(f"Analysis for memecoin with CA {data['address']} completed")
-                    # returns the analysis to the user on chat ui
-                    await ctx.send(sender, create_text_chat(final_analysis))
+                # try the local parser first, it answers only for unambiguous commands and saves an LLM round trip
+                with metrics.span("intent_parse.local"):
+                    data = parse_command(text)
+                if data is None:
+                    scheduler.submit(sender, PRIORITY_PARSE, partial(parse_and_dispatch, ctx, sender, text, key, received_at))
                 else:
-                    ctx.logger.info("I was unable to extract a valid command from your input")
-                
-
-            except Exception as e:
-                ctx.logger.error(f"Error processing message: {e}")
-                await ctx.send(sender, create_text_chat("An error occurred while processing your request. Please try again later."))
+                    dispatch_command(ctx, sender, data, text, key, received_at)
+            except SchedulerBusy as e:
+                # shed load right away instead of letting the request time out
+                ctx.logger.warning(f"Rejected message from {sender}, scheduler busy: {e}")
+                await timed_send(ctx, sender, create_text_chat("I'm handling a lot of requests right now. Please try again in a few seconds."))
         else:
             # Log any unexpected content types received
             ctx.logger.info(f"Got unexpected content from {sender}")
 
+
+def dispatch_command(ctx: Context, sender: str, data: dict, text: str, key: str, received_at: float, force: bool = False):
+    """Queue a parsed command on the scheduler, trades ahead of analyses"""
+    priority = PRIORITY_TRADE if data.get("type") in ("buy", "sell") else PRIORITY_ANALYSIS
+    # in multi-process mode single-token analyses run on the worker that owns the mint; multi-token analyses stay
+    # here, as one worker would fetch and cache mints owned by others, and so do trades, where the order pipeline
+    # keeps one wallet's orders in sequence whatever mint they are for
+    remote = (
+        worker_pool is not None and data.get("type") == "analysis" and data.get("address")
+        and len(data.get("addresses") or find_addresses(text)) <= 1
+    )
+    run = run_remote_command if remote else run_command
+    scheduler.submit(sender, priority, partial(run, ctx, sender, data, text, key, received_at), force=force)
+
+
+async def run_remote_command(ctx: Context, sender: str, data: dict, text: str, key: str, received_at: float):
+    """Run a command on its worker process, its replies are forwarded to the sender as they come"""
+    try:
+        await worker_pool.run(partial(timed_send, ctx, sender), sender, data, text, key, received_at)
+    except WorkerUnavailable as e:
+        ctx.logger.error(f"Worker failure while processing message: {e}")
+        await timed_send(ctx, sender, create_text_chat("I couldn't finish that analysis right now. Please try again in a moment."))
+
+
+async def parse_and_dispatch(ctx: Context, sender: str, text: str, key: str, received_at: float):
+    """Extract the command with the LLM, then queue it like a locally parsed one"""
+    prefetch = []
+    try:
+        # fetch on-chain data for any address in the message while the LLM works out the intent
+        prefetch = prefetch_token_info(text)
+        # function to extract command from user prompt on the frontend
+        # extracts commands from prompts in this form {"type": "buy", "address": "DezXAZ8z7PnrnRJjz3wXBoRgixCa6xjnB7YaB1pPB263", "amount": 0.0001}
+        with metrics.span("intent_parse.llm"):
+            command = await extract_prompt(text)
+            data = json.loads(command["choices"][0]["message"]["content"])
+        # already admitted, so the follow-up job is not shed
+        dispatch_command(ctx, sender, data, text, key, received_at, force=True)
+    except BudgetExhausted as e:
+        # the LLM is backing off, commands in the explicit format still work through the local parser
+        ctx.logger.warning(f"Could not parse message from {sender}: {e}")
+        await timed_send(ctx, sender, create_text_chat("I can't interpret free-form messages right now. Please use an explicit command like `analyze <address>`, `buy 0.1 <address>` or `sell 50% <address>`."))
+    except Exception as e:
+        ctx.logger.error(f"Error processing message: {e}")
+        await timed_send(ctx, sender, create_text_chat("An error occurred while processing your request. Please try again later."))
+    finally:
+        # unused prefetches are not wasted, the shared fetch keeps running and lands in the metrics cache
+        for task in prefetch:
+            task.cancel()
+
+
+async def run_command(ctx: Context, sender: str, data: dict, text: str, key: str, received_at: float):
+    """Execute a parsed buy/sell/analysis command and reply to the sender"""
+    # time from message arrival to a worker picking up the command (includes the LLM parse when there was one)
+    metrics.observe("dispatch_delay", (time.monotonic() - received_at) * 1000)
+    with metrics.span(f"request.{data.get('type')}", profile=True):
+        try:
+            # prompt interpretation is resolved as a buy or sell order, execute order leveraging pumpportal API
+            if data["type"] == "buy" or data["type"] == "sell":
+                # keyed on the message, so a redelivered or retried message cannot place the order twice
+                resp = await execute_command(json.dumps(data), idempotency_key=key, received_at=received_at)
+                # on failure
+                if resp['errors'] != []:
+                    await timed_send(ctx, sender, create_text_chat(f'{data["type"]} order for {data["address"]}, amount: {data["amount"]} failed with an error. /n Inspect for the error here: https://solscan.io/tx/{resp["signature"]}'))
+                else:
+                    # on success return message and solscan tx link
+                    await timed_send(ctx, sender, create_text_chat(f'{data["type"]} order for {data["address"]}, amount: {data["amount"]} executed successfully.   /n Transaction: https://solscan.io/tx/{resp["signature"]}'))
+            
+            # watchlist commands only touch the in-memory lists, the scanner picks the mints up on its next refresh
+            elif data["type"] == "watch":
+                added = []
+                for address in data.get("addresses") or [data["address"]]:
+                    if watchlist.add(sender, address):
+                        added.append(address)
+                reply = f"Watching {', '.join(added)}. I'll message you when the order flow, volume or price of a watched token breaks out." if added else "You're already watching that."
+                await timed_send(ctx, sender, create_text_chat(reply))
+            elif data["type"] == "unwatch":
+                removed = [address for address in data.get("addresses") or [data["address"]] if watchlist.remove(sender, address)]
+                reply = f"Stopped watching {', '.join(removed)}." if removed else "That token isn't on your watchlist."
+                await timed_send(ctx, sender, create_text_chat(reply))
+            elif data["type"] == "watchlist":
+                mints = watchlist.mints(sender)
+                reply = "Your watchlist:\n" + "\n".join(mints) if mints else "Your watchlist is empty. Add a token with `watch <address>`."
+                await timed_send(ctx, sender, create_text_chat(reply))
+
+            # if user prompts is interpreted by the LLM to indicate a memecoin analysis request:   
+            elif data["type"] == "analysis" and len(data.get("addresses") or find_addresses(text)) > 1:
+                # several tokens in one message: one batched bitquery request, briefings generated concurrently
+                addresses = data.get("addresses") or find_addresses(text)
+                fetched = await get_memecoin_info_for_addresses(addresses)
+                infos = {address: info for address, info in fetched.items() if not isinstance(info, Exception)}
+                failed = [address for address in fetched if address not in infos]
+                if failed:
+                    ctx.logger.warning(f"No metrics for {len(failed)} of {len(fetched)} tokens")
+                    await timed_send(ctx, sender, create_text_chat(
+                        "I couldn't get on-chain data for " + ", ".join(failed) + " right now, please try those again shortly.",
+                        end_session=not infos,
+                    ))
+                remaining = len(infos)
+                async for address, analysis in iter_analyses_from_agent(infos):
+                    remaining -= 1
+                    final_analysis = analysis["choices"][0]["message"]["content"]
+                    if analysis.get("cached"):
+                        final_analysis = CACHED_NOTE + final_analysis
+                    ctx.logger.info(f"Analysis for memecoin with CA {address} completed")
+                    # each briefing is sent as soon as it is ready, the last one closes the session
+                    await timed_send(ctx, sender, create_text_chat(f"{address}\n\n{final_analysis}", end_session=remaining == 0))
+
+            elif data["type"] == "analysis":
+                # get coin data from bitquery api
+                info = await get_memecoin_info_from_address(data["address"])
+                cached = analysis_cache.get(info)
+                if cached is not None:
+                    # metrics are within tolerance of a recent briefing, answer right away
+                    ctx.logger.info(f"Analysis for memecoin with CA {data['address']} served from cache")
+                    await timed_send(ctx, sender, create_text_chat(f'{CACHED_NOTE}{cached["choices"][0]["message"]["content"]}'))
+                elif STREAM_ANALYSIS:
+                    # forward each section as soon as it is generated, holding one back so the last carries end-session
+                    pending = None
+                    async for section in stream_analysis_from_agent(info):
+                        if pending is not None:
+                            await timed_send(ctx, sender, create_text_chat(pending, end_session=False))
+                        pending = section
+                    ctx.logger.info(f"Analysis for memecoin with CA {data['address']} completed")
+                    await timed_send(ctx, sender, create_text_chat(pending or "The analysis came back empty, please try again."))
+                else:
+                    # Our DegenAI gives its expert analysis and score (the cache was checked above)
+                    analysis = await get_analysis_from_agent(info, check_cache=False)
+                    final_analysis = analysis["choices"][0]["message"]["content"]
+                    ctx.logger.info(f"Analysis for memecoin with CA {data['address']} completed")
+                    # returns the analysis to the user on chat ui
+                    await timed_send(ctx, sender, create_text_chat(final_analysis))
+            else:
+                ctx.logger.info("I was unable to extract a valid command from your input")
+
+        except OrderOutcomeUnknown as e:
+            # the order may have gone out before it failed, a blind retry could place it twice
+            ctx.logger.error(f"Order outcome unknown: {e}")
+            await timed_send(ctx, sender, create_text_chat("I lost track of your order while it was being processed. Please check your wallet before placing it again."))
+        except UpstreamError as e:
+            # an upstream is failing or unavailable: say so instead of answering from an error page
+            ctx.logger.error(f"Upstream failure while processing message: {e}")
+            await timed_send(ctx, sender, create_text_chat("I couldn't reach one of my data sources right now. Please try again in a minute."))
+        except WatchlistFull as e:
+            await timed_send(ctx, sender, create_text_chat(f"I couldn't add that token, {e}. Remove one with `unwatch <address>` first."))
+        except OrderQueueFull as e:
+            ctx.logger.warning(f"Order rejected, queue full: {e}")
+            await timed_send(ctx, sender, create_text_chat("Too many orders are pending right now, your order was not placed. Please try again in a moment."))
+        except Exception as e:
+            ctx.logger.error(f"Error processing message: {e}")
+            await timed_send(ctx, sender, create_text_chat("An error occurred while processing your request. Please try again later."))
+
+async def send_watchlist_alerts(ctx: Context, triggered: dict):
+    """
+    Send the alerts of a watchlist refresh to everyone watching the triggering mints
+
+    Only the triggered mints get an LLM briefing, the most watched first and at most WATCHLIST_MAX_ANALYSES per
+    refresh; the others are sent with the locally computed summary so a market-wide move cannot flood the LLM.
+    """
+    ranked = sorted(triggered, key=lambda mint: len(watchlist.watchers(mint)), reverse=True)
+    analyzed = {mint: triggered[mint]["info"] for mint in ranked[:WATCHLIST_MAX_ANALYSES]}
+
+    async def deliver(mint: str, briefing: str):
+        text = f"{watchlist.alert_text(mint, triggered[mint])}\n\n{briefing}"
+        await asyncio.gather(*(timed_send(ctx, watcher, create_text_chat(text)) for watcher in watchlist.watchers(mint)))
+
+    for mint in ranked[WATCHLIST_MAX_ANALYSES:]:
+        await deliver(mint, summarize(triggered[mint]["info"]))
+    async for mint, analysis in iter_analyses_from_agent(analyzed):
+        await deliver(mint, analysis["choices"][0]["message"]["content"])
+    ctx.logger.info(f"Sent watchlist alerts for {len(triggered)} tokens")
+
 # msg acknowledgement
 @chat_proto.on_message(ChatAcknowledgement)
 async def handle_ack(ctx: Context, sender: str, msg: ChatAcknowledgement):
@@ -153,7 +349,8 @@ async def handle_structured_output_response(
         return
 
     if "<UNKNOWN>" in str(msg.output):
-        await ctx.send(
+        await timed_send(
+            ctx,
             session_sender,
             create_text_chat(
                 "Sorry, I couldn't process your request. Please include a valid Memecoin contract address."
@@ -167,7 +364,8 @@ async def handle_structured_output_response(
         contract_address = analysis_request.contract_address
         
         if not contract_address:
-            await ctx.send(
+            await timed_send(
+                ctx,
                 session_sender,
                 create_text_chat(
                     "Sorry, I couldn't find a valid Memecoin contract address in your query."
@@ -182,11 +380,12 @@ async def handle_structured_output_response(
         response_text = token_analysis
 
         # Send the response back to the user
-        await ctx.send(session_sender, create_text_chat(response_text))
+        await timed_send(ctx, session_sender, create_text_chat(response_text))
         
     except Exception as err:
         ctx.logger.error(err)
-        await ctx.send(
+        await timed_send(
+            ctx,
             session_sender,
             create_text_chat(
                 "Sorry, I couldn't process this request. I Give up"
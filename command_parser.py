@@ -0,0 +1,168 @@
+"""File Description
+
+    This module is a deterministic fast path for command extraction. Most chat traffic is short and regular
+    ("buy 0.1 sol of <mint>", "analyze <mint>"), so before paying for an asi1-mini round trip we try to parse the
+    message locally: validate base58 Solana addresses, match intent keywords and pull out the SOL amount or the
+    percentage to sell. parse_command only answers when the message is unambiguous and returns the same
+    {"type", "address", "amount"} shape the LLM parser produces; anything else returns None and falls back to the LLM.
+    A trade containing any word the parser does not know (another unit, "tokens" after a buy amount ...) is ambiguous.
+    Analysis requests may name several tokens, in which case every address is listed under "addresses"; trades may
+    carry an optional "slippage" (percent) and "priority_fee" (SOL). Watchlist commands ("watch <mint>",
+    "unwatch <mint>", "watchlist") are only understood here, the LLM parser does not know them.
+"""
+
+import re
+import base58
+
+# base58 drops 0, O, I and l; Solana public keys are 32 bytes, i.e. 32 to 44 base58 characters
+_ADDRESS_RE = re.compile(r"(?<![1-9A-HJ-NP-Za-km-z])[1-9A-HJ-NP-Za-km-z]{32,44}(?![1-9A-HJ-NP-Za-km-z])")
+_NUMBER_RE = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?|\.\d+)\s*(sol\b|%|percent\b)?", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z']+")
+# per-order trade settings, e.g. "slippage 15%" or "priority fee 0.0005"
+_SLIPPAGE_RE = re.compile(r"\bslippage\s*(?:of\s*|=\s*|:\s*)?(\d+(?:\.\d+)?)\s*%?", re.IGNORECASE)
+_FEE_RE = re.compile(r"\b(?:priority\s*)?fee\s*(?:of\s*|=\s*|:\s*)?(\d+(?:\.\d+)?|\.\d+)\s*(?:sol\b)?", re.IGNORECASE)
+
+_BUY_WORDS = {"buy", "ape", "long", "purchase", "grab", "snipe"}
+_SELL_WORDS = {"sell", "dump", "exit", "short"}
+_ANALYSIS_WORDS = {
+    "analyze", "analyse", "analysis", "analyzing", "check", "review", "score", "rate", "research", "dyor",
+    "thoughts", "take", "opinion", "safe", "rug", "insight", "insights", "outlook", "briefing",
+}
+_WATCH_WORDS = {"watch", "track", "monitor", "follow"}
+_UNWATCH_WORDS = {"unwatch", "untrack", "unfollow"}
+_STOP_WATCHING_RE = re.compile(r"\bstop\s+(?:watching|tracking|monitoring|following)\b")
+_WATCHLIST_RE = re.compile(r"^\s*/?(?:my\s+)?watch\s*list\s*[?.!]?\s*$", re.IGNORECASE)
+# the only other words a trade may contain; an unknown word ("tokens", "usdc", ...) can change what the amount means,
+# so the message goes to the LLM rather than being read as SOL
+_TRADE_FILLER = {
+    "sol", "percent", "of", "for", "worth", "into", "in", "on", "at", "a", "an", "the", "some", "me", "i", "i'm", "im",
+    "my", "please", "pls", "plz", "now", "want", "wanna", "to", "would", "like", "let's", "lets", "go", "and", "just", "with",
+}
+# a sell amount is a share of the position, these only name the position
+_SELL_FILLER = {"position", "bag", "bags", "holdings", "stack", "tokens"}
+_CURRENCY_RE = re.compile(r"[$€£¥]")
+_NEGATIONS = {"not", "don't", "dont", "never", "no", "shouldn't", "shouldnt", "won't", "wont"}
+_FRACTIONS = {"half": 50, "quarter": 25, "all": 100, "everything": 100}
+
+
+def is_solana_address(candidate: str) -> bool:
+    """True when candidate is valid base58 and decodes to a 32 byte public key"""
+    try:
+        return len(base58.b58decode(candidate)) == 32
+    except ValueError:
+        return False
+
+
+def find_addresses(text: str) -> list:
+    """Return the distinct valid Solana addresses in text, in the order they appear"""
+    addresses = []
+    for match in _ADDRESS_RE.findall(text):
+        if match not in addresses and is_solana_address(match):
+            addresses.append(match)
+    return addresses
+
+
+def _extract_amount(text: str):
+    """Return (value, unit) for the single number in text, or None when there is none or more than one"""
+    numbers = _NUMBER_RE.findall(text)
+    if len(numbers) != 1:
+        return None
+    value, unit = numbers[0]
+    return float(value), unit.lower()
+
+
+def parse_command(text: str):
+    """
+    Parse a chat message into a command without calling the LLM
+
+    Args:
+        text: raw user message
+
+    Returns:
+        {"type": "buy|sell|analysis", "address": ..., "amount": ...} when the message is unambiguous, otherwise None;
+        watchlist commands are {"type": "watch|unwatch", "address": ..., "addresses": [...]} and {"type": "watchlist"}
+    """
+    if _WATCHLIST_RE.match(text):
+        return {"type": "watchlist"}
+    addresses = find_addresses(text)
+    if not addresses:
+        return None
+    address = addresses[0]
+
+    # drop the addresses so base58 characters are not read as intent words or amounts
+    remainder = text
+    for candidate in addresses:
+        remainder = remainder.replace(candidate, " ")
+    remainder = remainder.lower()
+
+    # pull out trade settings first so their numbers are not taken for the amount
+    settings = {}
+    for key, pattern in (("slippage", _SLIPPAGE_RE), ("priority_fee", _FEE_RE)):
+        found = pattern.findall(remainder)
+        if len(found) > 1:
+            return None
+        if found:
+            settings[key] = float(found[0])
+            remainder = pattern.sub(" ", remainder)
+
+    words = set(_WORD_RE.findall(remainder))
+
+    # "stop watching" reads as a negation, so unwatching is settled before the negation check
+    if (words & _UNWATCH_WORDS or _STOP_WATCHING_RE.search(remainder)) and not settings \
+            and not words & (_BUY_WORDS | _SELL_WORDS):
+        return {"type": "unwatch", "address": address, "addresses": addresses}
+
+    if words & _NEGATIONS:
+        return None
+
+    intents = set()
+    if words & _BUY_WORDS:
+        intents.add("buy")
+    if words & _SELL_WORDS:
+        intents.add("sell")
+    if words & _ANALYSIS_WORDS or "good time" in remainder or "?" in remainder:
+        intents.add("analysis")
+
+    amount = _extract_amount(remainder)
+
+    if not intents and words & _WATCH_WORDS and "?" not in remainder:
+        if amount is not None or settings:
+            return None
+        return {"type": "watch", "address": address, "addresses": addresses}
+
+    if intents == {"analysis"}:
+        if amount is not None or settings:
+            return None
+        command = {"type": "analysis", "address": address, "amount": "none"}
+        if len(addresses) > 1:
+            command["addresses"] = addresses
+        return command
+
+    # trades target exactly one token
+    if len(addresses) != 1:
+        return None
+
+    # a trade question ("should I buy X?") is a request for analysis, leave it to the LLM
+    if len(intents) != 1 or "?" in remainder:
+        return None
+
+    known = _BUY_WORDS | _TRADE_FILLER if intents == {"buy"} else _SELL_WORDS | _TRADE_FILLER | _SELL_FILLER | set(_FRACTIONS)
+    if words - known or _CURRENCY_RE.search(remainder):
+        return None
+
+    if intents == {"buy"}:
+        if amount is None or amount[1] not in ("", "sol") or amount[0] <= 0:
+            return None
+        return {"type": "buy", "address": address, "amount": amount[0], **settings}
+
+    # sells are expressed as a percentage of the position, as in the LLM parser's schema
+    fractions = words & set(_FRACTIONS)
+    if amount is not None and amount[1] in ("%", "percent") and not fractions:
+        percent = amount[0]
+    elif amount is None and len(fractions) == 1:
+        percent = _FRACTIONS[fractions.pop()]
+    else:
+        return None
+    if not 0 < percent <= 100:
+        return None
+    return {"type": "sell", "address": address, "amount": percent, **settings}
@@ -0,0 +1,139 @@
+"""File Description
+
+    This module turns Bitquery's 15-minute token metrics into derived features and a deterministic 1-10 safety
+    score, so the LLM gets a short, pre-digested summary instead of the raw GraphQL JSON and no longer has to invent
+    the score itself. Everything works on NumPy arrays with one row per token, which lets thousands of tokens be
+    scored in a single call (batch analysis, watchlists, backtests) at the same cost per token as one.
+"""
+
+import json
+
+import numpy as np
+
+from windows import summarize_windows
+
+# raw metric columns, in the order metrics_matrix lays them out
+RAW_FIELDS = (
+    "start", "end", "p99", "makers", "buyers", "sellers", "trades", "buys", "sells",
+    "volume", "buy_volume", "sell_volume",
+)
+RAW = {name: index for index, name in enumerate(RAW_FIELDS)}
+
+FEATURE_NAMES = (
+    "buy_sell_delta", "volume_imbalance", "price_change", "p99_gap", "trades_per_maker", "buyer_seller_ratio",
+)
+FEATURES = {name: index for index, name in enumerate(FEATURE_NAMES)}
+
+
+def _row_values(row: dict) -> list:
+    trade = row.get("Trade") or {}
+    return [
+        trade.get("start"), trade.get("end"), row.get("price_15min_allTimeHigh"),
+        row.get("makers_15min"), row.get("buyers_15min"), row.get("sellers_15min"),
+        row.get("trades_15min"), row.get("buys_15min"), row.get("sells_15min"),
+        row.get("traded_volume_15min"), row.get("buy_volume_15min"), row.get("sell_volume_15min"),
+    ]
+
+
+def metrics_matrix(rows: list) -> np.ndarray:
+    """Stack DEXTradeByTokens rows into an (n_tokens, len(RAW_FIELDS)) float array, missing values become 0"""
+    if not rows:
+        return np.zeros((0, len(RAW_FIELDS)))
+    values = [[float(value) if value is not None else np.nan for value in _row_values(row)] for row in rows]
+    return np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+
+def compute_features(raw: np.ndarray) -> np.ndarray:
+    """Derived features for every token row of a metrics_matrix, shape (n_tokens, len(FEATURE_NAMES))"""
+    start, end, p99 = raw[:, RAW["start"]], raw[:, RAW["end"]], raw[:, RAW["p99"]]
+    volume = raw[:, RAW["volume"]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        features = np.column_stack((
+            raw[:, RAW["buys"]] - raw[:, RAW["sells"]],
+            np.where(volume > 0, (raw[:, RAW["buy_volume"]] - raw[:, RAW["sell_volume"]]) / volume, 0.0),
+            np.where(start > 0, (end - start) / start, 0.0),
+            np.where(end > 0, (p99 - end) / end, 0.0),
+            raw[:, RAW["trades"]] / np.maximum(raw[:, RAW["makers"]], 1),
+            raw[:, RAW["buyers"]] / np.maximum(raw[:, RAW["sellers"]], 1),
+        ))
+    return np.nan_to_num(features)
+
+
+def score(raw: np.ndarray, features: np.ndarray = None) -> np.ndarray:
+    """
+    Deterministic 1-10 safety score per token, higher is safer to buy
+
+    The score starts neutral and moves with order-flow strength, broad participation and price structure:
+    buy-side volume and more buyers than sellers lift it, thin maker counts, bot-like trades per maker, price
+    far below its 15m p99 (a dump in progress) and parabolic pumps pull it down.
+    """
+    if features is None:
+        features = compute_features(raw)
+    makers = raw[:, RAW["makers"]]
+    imbalance = features[:, FEATURES["volume_imbalance"]]
+    change = features[:, FEATURES["price_change"]]
+    gap = features[:, FEATURES["p99_gap"]]
+    per_maker = features[:, FEATURES["trades_per_maker"]]
+    ratio = features[:, FEATURES["buyer_seller_ratio"]]
+
+    points = (
+        5.0
+        + 2.0 * imbalance
+        + 1.5 * np.tanh(np.log(np.maximum(ratio, 1e-3)))
+        + 1.5 * np.tanh(np.log1p(makers) - np.log(50))
+        + np.where(change > 0, np.minimum(change, 0.5) * 2.0, np.maximum(change, -0.5) * 4.0)
+        - np.where(change > 1.0, np.minimum(change - 1.0, 2.0), 0.0)
+        - 2.0 * np.clip(gap, 0.0, 1.0)
+        - np.clip((per_maker - 5.0) / 5.0, 0.0, 2.0)
+    )
+    points = np.where(raw[:, RAW["trades"]] > 0, points, 1.0)
+    return np.clip(np.rint(points), 1, 10).astype(int)
+
+
+def parse_rows(token_info: str) -> list:
+    """DEXTradeByTokens rows from a Bitquery response text, empty when it is not a metrics response"""
+    try:
+        return json.loads(token_info)["data"]["Solana"]["DEXTradeByTokens"] or []
+    except (TypeError, ValueError, KeyError):
+        return []
+
+
+def parse_windows(token_info: str) -> dict:
+    """Per-timeframe metrics of a multi-window response (see query.fetch_memecoin_info_multiwindow), empty otherwise"""
+    try:
+        return json.loads(token_info).get("windows") or {}
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+
+def summarize(token_info: str) -> str:
+    """
+    Compact feature summary of a Bitquery metrics response for the analysis prompt
+
+    Returns:
+        A few lines of derived metrics and the safety score, or token_info unchanged when it holds no metrics
+        (error messages and empty results are passed to the LLM as they are)
+    """
+    rows = parse_rows(token_info)
+    timeframes = parse_windows(token_info)
+    if not rows:
+        return summarize_windows(timeframes) if timeframes else token_info
+    raw = metrics_matrix(rows[:1])
+    features = compute_features(raw)
+    safety = int(score(raw, features)[0])
+    r, f = raw[0], features[0]
+    currency = (rows[0].get("Trade") or {}).get("Currency") or {}
+
+    return "\n".join((
+        f"Token: {currency.get('Name')} ({currency.get('Symbol')}) {currency.get('MintAddress')}",
+        f"15m price: ${r[RAW['end']]:.10g} (start ${r[RAW['start']]:.10g}, change {f[FEATURES['price_change']]:+.1%}), "
+        f"p99 ${r[RAW['p99']]:.10g} (p99 gap {f[FEATURES['p99_gap']]:+.1%})",
+        f"15m volume: ${r[RAW['volume']]:,.0f} (buys ${r[RAW['buy_volume']]:,.0f}, sells ${r[RAW['sell_volume']]:,.0f}, "
+        f"imbalance {f[FEATURES['volume_imbalance']]:+.2f})",
+        f"15m trades: {r[RAW['trades']]:.0f} ({r[RAW['buys']]:.0f} buys, {r[RAW['sells']]:.0f} sells, "
+        f"delta {f[FEATURES['buy_sell_delta']]:+.0f})",
+        f"15m makers: {r[RAW['makers']]:.0f} ({r[RAW['buyers']]:.0f} buyers, {r[RAW['sellers']]:.0f} sellers, "
+        f"ratio {f[FEATURES['buyer_seller_ratio']]:.2f}), {f[FEATURES['trades_per_maker']]:.1f} trades per maker",
+        f"Safety score: {safety}/10",
+    ) + ((summarize_windows(timeframes),) if timeframes else ()))
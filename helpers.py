@@ -1,17 +1,49 @@
 """File Description
     This is a helper module which defines two asynchronous functions —> extract_prompt and get_analysis_from_agent—that
     send user input to Fetch.ai’s ASI‑1 API with different system prompts (one to parse commands into JSON,
-    the other to generate a detailed memecoin analysis), then a synchronous execute_command function that reads 
-    that JSON, determines if it’s a buy or sell order, and if so calls PumpPortal’s trading API to execute the trade; 
+    the other to generate a detailed memecoin analysis), then an asynchronous execute_command function that reads 
+    that JSON, determines if it’s a buy or sell order, and if so hands it to the order pipeline (orders.py) for PumpPortal; 
     overall, it bridges user‑friendly prompts, LLM‑driven parsing and analysis, and on‑chain trading into a single 
     automated workflow.
 """
 
-import requests
+import os
+import time
+import logging
 import json
+import asyncio
+from datetime import datetime
+from http_client import asi1
+from orders import Order, order_pipeline
+from cache import AnalysisCache
+from features import summarize
+from resilience import UpstreamError
+import metrics
 
-ASI1_Endpoint = "https://api.asi1.ai/v1/chat/completions"
-apikey = PUMP_PORTAL_API_KEY
+logger = logging.getLogger(__name__)
+
+ASI1_Endpoint = os.getenv("ASI1_ENDPOINT", "https://api.asi1.ai/v1/chat/completions")
+
+# upper bound on briefings generated at once for a multi-token analysis request
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", 4))
+# send the analysis to the chat as it is generated, section by section, instead of all at once
+STREAM_ANALYSIS = os.getenv("STREAM_ANALYSIS", "true").lower() == "true"
+# longest streamed chunk held back while waiting for a section heading
+STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", 1200))
+
+# finished briefings are reused while the token's metrics stay within these relative tolerances
+analysis_cache = AnalysisCache(
+    max_age=float(os.getenv("ANALYSIS_CACHE_MAX_AGE", 300)),
+    maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", 512)),
+    price_tolerance=float(os.getenv("ANALYSIS_PRICE_TOLERANCE", 0.02)),
+    volume_tolerance=float(os.getenv("ANALYSIS_VOLUME_TOLERANCE", 0.10)),
+    ratio_tolerance=float(os.getenv("ANALYSIS_RATIO_TOLERANCE", 0.10)),
+    stale_max_age=float(os.getenv("ANALYSIS_STALE_MAX_AGE", 1800)),
+)
+
+# prefixes on briefings produced without the LLM while the ASI-1 budget is low or ASI-1 is failing
+STALE_NOTE = "⏳ _The analyst is busy right now, serving the latest briefing for this token (from {time} UTC)._\n\n"
+SUMMARY_NOTE = "⏳ _The analyst is busy right now, here are the computed metrics and score. Ask again in a few minutes for the full briefing._\n\n"
 
 
 headers = {
@@ -72,13 +104,50 @@ async def extract_prompt(token_info: str):
         "max_tokens": 5000
     })
 
-    response = requests.request("POST", ASI1_Endpoint, headers=headers, data=payload)
+    response = await asi1.post(ASI1_Endpoint, headers=headers, data=payload)
+    command = _completion(response)
+    _charge_usage(command)
+    return command
 
-    return response.json()
 
+def _completion(response) -> dict:
+    """Parsed ASI-1 completion; error statuses and bodies without choices raise UpstreamError"""
+    try:
+        completion = response.json()
+    except ValueError:
+        completion = {}
+    if response.status != 200 or not completion.get("choices"):
+        raise UpstreamError(f"ASI-1 returned {response.status}: {response.text[:200]}")
+    return completion
 
-async def get_analysis_from_agent(token_info: str):
-    payload = json.dumps({
+
+def _charge_usage(completion: dict):
+    """Charge the LLM tokens a completion reports against the ASI-1 budget"""
+    usage = (completion.get("usage") or {}) if isinstance(completion, dict) else {}
+    if usage.get("total_tokens"):
+        asi1.budget.charge(usage["total_tokens"])
+
+
+def degraded_analysis(token_info: str) -> dict:
+    """
+    Briefing produced without calling ASI-1: the latest cached one for the token if there is one, otherwise the
+    locally computed metrics summary and score
+
+    Returns:
+        A completion-shaped dict with "degraded": True
+    """
+    metrics.count("degraded.llm_analysis")
+    stale = analysis_cache.get_stale(token_info)
+    if stale is not None:
+        when = datetime.utcfromtimestamp(stale["generated_at"]).strftime("%H:%M")
+        content = STALE_NOTE.format(time=when) + stale["choices"][0]["message"]["content"]
+    else:
+        content = SUMMARY_NOTE + summarize(token_info)
+    return {"choices": [{"message": {"content": content}}], "degraded": True}
+
+
+def _analysis_payload(token_info: str, stream: bool = False) -> str:
+    return json.dumps({
         "model": "asi1-mini",
         "messages": [
             {
@@ -90,45 +159,151 @@ async def get_analysis_from_agent(token_info: str):
                     emojis to enhance readability and speak in full sentences like a crypto expert without resorting to three‑word commands
                     or terse bullet points. Be as specific as possible by referencing key metrics (e.g., buy‑sell delta, slippage rates)
                     and explain why each matters to a 15‑minute scalp 📊🔍. Also, always output price in this manner: price(marketcap) for example $0.001(1m market cap),
-                    Assume every new token is a rug until it proves profitable, and close with a bold three‑word trade command (e.g., “Scale In Now”) 🚀🔒. Lastly give each token
-                    a score from 1-10 based on how safe it is to buy the coin, you must consider every available informatio about that coin before
-                    giving it a well thought out score. 
+                    Assume every new token is a rug until it proves profitable, and close with a bold three‑word trade command (e.g., “Scale In Now”) 🚀🔒. Lastly report
+                    the token's safety score from 1-10 exactly as given in the data (it is computed from the metrics) and explain which
+                    metrics drive it. 
             """
             },
             {
             "role": "user",
-            "content": f"{token_info}"
+            "content": f"{summarize(token_info)}"
             }
         ],
         "temperature": 0.2,
-        "stream": False,
+        "stream": stream,
         "max_tokens": 5000
     })
 
-    response = requests.request("POST", ASI1_Endpoint, headers=headers, data=payload)
-    return response.json()
+
+async def get_analysis_from_agent(token_info: str, check_cache: bool = True):
+    # metrics barely moved since the last briefing for this token, reuse it ("cached": True in the response);
+    # check_cache=False for callers that already looked, so a miss is not counted twice
+    if check_cache:
+        cached = analysis_cache.get(token_info)
+        if cached is not None:
+            return cached
+    if asi1.budget.low():
+        return degraded_analysis(token_info)
+
+    payload = _analysis_payload(token_info)
+
+    try:
+        with metrics.span("llm_analysis"):
+            response = await asi1.post(ASI1_Endpoint, headers=headers, data=payload)
+        analysis = _completion(response)
+    except UpstreamError as e:
+        # ASI-1 is failing or its circuit is open, the metrics and score are still worth sending
+        logger.warning(f"Analysis failed, degrading: {e}")
+        return degraded_analysis(token_info)
+    _charge_usage(analysis)
+    analysis_cache.set(token_info, analysis)
+    return analysis
+
+
+def _split_section(buffer: str):
+    """Split off the text before the last markdown heading or bold section title in buffer, if any"""
+    cut = max(buffer.rfind("\n#"), buffer.rfind("\n**"))
+    if cut > 0:
+        return buffer[:cut].strip(), buffer[cut + 1:]
+    if len(buffer) > STREAM_CHUNK_CHARS:
+        # no heading for a while, fall back to the last paragraph break
+        cut = buffer.rfind("\n\n")
+        if cut > 0:
+            return buffer[:cut].strip(), buffer[cut + 2:]
+    return None, buffer
+
+
+async def stream_analysis_from_agent(token_info: str):
+    """
+    Stream the analysis briefing from ASI-1, one section at a time
+
+    Args:
+        token_info: token metrics passed to the LLM
+
+    Yields:
+        Markdown chunks, each ending at a section boundary; the last chunk holds whatever remains
+    """
+    if asi1.budget.low():
+        yield degraded_analysis(token_info)["choices"][0]["message"]["content"]
+        return
+
+    payload = _analysis_payload(token_info, stream=True)
+    buffer = ""
+    sections = []
+    # the consumer's time between chunks is excluded, only time spent waiting on ASI-1 is recorded
+    waited = 0.0
+    started = time.perf_counter()
+
+    try:
+        async with asi1.stream("POST", ASI1_Endpoint, headers={**headers, "Accept": "text/event-stream"}, data=payload) as response:
+            if response.status != 200:
+                raise UpstreamError(f"ASI-1 stream failed with status {response.status}: {await response.text()}")
+            # server-sent events, one `data: {...}` line per delta and `data: [DONE]` at the end
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                buffer += (choices[0].get("delta") or {}).get("content") or ""
+                section, buffer = _split_section(buffer)
+                if section:
+                    waited += time.perf_counter() - started
+                    if not sections:
+                        metrics.observe("llm_analysis.first_chunk", waited * 1000)
+                    sections.append(section)
+                    yield section
+                    started = time.perf_counter()
+    except UpstreamError as e:
+        if sections:
+            raise
+        # nothing sent yet, answer with the cached briefing or the metrics summary instead
+        logger.warning(f"Analysis stream failed, degrading: {e}")
+        yield degraded_analysis(token_info)["choices"][0]["message"]["content"]
+        return
+
+    waited += time.perf_counter() - started
+    metrics.observe("llm_analysis.stream", waited * 1000)
+    if buffer.strip():
+        sections.append(buffer.strip())
+        yield buffer.strip()
+
+    if sections:
+        content = "\n\n".join(sections)
+        # streamed completions carry no usage, estimate ~4 characters per token for prompt and briefing
+        asi1.budget.charge((len(payload) + len(content)) / 4)
+        analysis_cache.set(token_info, {"choices": [{"message": {"content": content}}]})
+
+
+async def iter_analyses_from_agent(infos: dict, concurrency: int = ANALYSIS_CONCURRENCY):
+    """
+    Generate briefings for several tokens concurrently, at most `concurrency` LLM calls at a time
+
+    Args:
+        infos: dict of address -> token info text
+
+    Yields:
+        (address, analysis response) pairs in the order they finish
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(address, info):
+        async with semaphore:
+            return address, await get_analysis_from_agent(info)
+
+    for finished in asyncio.as_completed([analyze(address, info) for address, info in infos.items()]):
+        yield await finished
 
 
-def execute_command(command:str):
+async def execute_command(command:str, idempotency_key: str = None, received_at: float = None):
     data = json.loads(command)
 
     if data["type"] == "buy" or data["type"] == "sell":
-        order_type = data["type"]
-        amount = data["amount"]
-        address = data["address"]
-        denominatedInSol = "true" if order_type=="buy" else "false"
-
-        response = requests.post(url=f"https://pumpportal.fun/api/trade?api-key={apikey}", data={
-            "action": order_type,  # "buy" or "sell"
-            "mint": address,  # contract address of the token you want to trade
-            "amount": amount,  # amount of SOL or tokens to trade
-            "denominatedInSol": denominatedInSol,  # "true" if amount is amount of SOL, "false" if amount is number of tokens
-            "slippage": 10,  # percent slippage allowed
-            "priorityFee": 0.0000,  # amount used to enhance transaction speed
-            "pool": "auto"  # exchange to trade on. "pump", "raydium", "pump-amm", "launchlab", "raydium-cpmm" or "auto"
-        })
-        
-        resp = response.json()  # Tx signature or error(s)
+        # queued through the order pipeline: pooled connection, per-wallet ordering, duplicate protection and timings
+        order = Order.from_command(data, idempotency_key=idempotency_key, received_at=received_at)
+        resp = await order_pipeline.submit(order)  # Tx signature or error(s)
         return resp
     else:
-        print("we encountered an error")
\ No newline at end of file
+        print("we encountered an error")
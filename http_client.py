@@ -0,0 +1,249 @@
+"""File Description
+
+    This module is the shared HTTP layer for every upstream the agent talks to (ASI-1, Bitquery and PumpPortal).
+    Each upstream gets its own aiohttp session with a keep-alive connection pool, a default per-call timeout and a
+    concurrency limit, so a chat handler awaiting the network never blocks the uAgents event loop, TLS connections
+    are reused between messages, and one slow upstream cannot starve the others. Upstreams with a rate limit carry an
+    UpstreamBudget that every response is reported to, and calls fail fast while the upstream is backing off after a
+    429. Sessions are created lazily on the running loop and closed on agent shutdown through close_all().
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+import metrics
+from ratelimit import BudgetExhausted, UpstreamBudget
+from resilience import CircuitBreaker, UpstreamError, backoff_delay, hedge_delay
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamResponse:
+    """Fully read response, so the connection goes back to the pool before the caller parses it"""
+
+    def __init__(self, status: int, headers: dict, text: str):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Upstream:
+    """Pooled client for a single upstream API"""
+
+    def __init__(self, name: str, pool_size: int = 20, concurrency: int = 10, timeout: float = 30.0,
+                 keepalive: float = 60.0, budget: UpstreamBudget = None, deadline: float = None, retries: int = 0):
+        self.name = name
+        self.budget = budget
+        self.deadline = deadline if deadline is not None else timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(name)
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self._session = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _spend(self):
+        if self.budget is None:
+            return
+        if self.budget.blocked_for() > 0:
+            raise BudgetExhausted(f"{self.name} is rate limited for another {self.budget.blocked_for():.0f}s")
+        self.budget.charge(self.budget.request_cost)
+
+    def _record(self, status: int, headers):
+        if status >= 400:
+            metrics.count(f"upstream.{self.name}.http_{status}")
+        if self.budget is not None:
+            self.budget.observe(status, headers)
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def _attempt(self, method: str, url: str, timeout: float, **kwargs) -> UpstreamResponse:
+        self._spend()
+        try:
+            async with self._semaphore:
+                with metrics.span(f"upstream.{self.name}"):
+                    async with self.session().request(method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+                        text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        self._record(response.status, response.headers)
+        return UpstreamResponse(response.status, dict(response.headers), text)
+
+    async def _hedged(self, method: str, url: str, timeout: float, **kwargs) -> UpstreamResponse:
+        """One attempt, plus a second one if the first is still running past the upstream's hedge delay"""
+        delay = hedge_delay(self.name)
+        attempts = [asyncio.ensure_future(self._attempt(method, url, timeout, **kwargs))]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done:
+                    metrics.count(f"upstream.{self.name}.hedged")
+                    attempts.append(asyncio.ensure_future(self._attempt(method, url, timeout, **kwargs)))
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None and attempt.result().status < 500:
+                        return attempt.result()
+            # every attempt failed: an error response beats an exception, the first attempt's wins a tie
+            for attempt in attempts:
+                if attempt.exception() is None:
+                    return attempt.result()
+            raise attempts[0].exception()
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+                elif not attempt.cancelled():
+                    attempt.exception()  # retrieved, the outcome was decided by another attempt or the deadline
+
+    async def request(self, method: str, url: str, timeout: float = None, idempotent: bool = False,
+                      **kwargs) -> UpstreamResponse:
+        """
+        Send a request through this upstream's pool
+
+        The whole call, retries included, is bounded by the upstream's deadline. Idempotent reads are hedged and
+        retried with jittered backoff on connection errors, timeouts and 5xx answers; other calls get one attempt.
+
+        Args:
+            method: HTTP method
+            url: full request url
+            timeout: per-attempt total timeout in seconds, defaults to the upstream's timeout
+            idempotent: the request can safely be sent more than once
+            **kwargs: passed through to aiohttp (headers, data, json, params ...)
+
+        Returns:
+            UpstreamResponse with the body already read (5xx answers included once retries are used up)
+
+        Raises:
+            CircuitOpen: while the upstream's circuit breaker is open
+            BudgetExhausted: while the upstream is backing off after a 429
+            UpstreamError: on a connection error or timeout that was not retried away
+        """
+        probe = self.breaker.check()
+        try:
+            deadline = time.monotonic() + self.deadline
+            attempt_timeout = timeout if timeout is not None else self.timeout
+            retries = 0
+            while True:
+                failure, response = None, None
+                try:
+                    call = self._hedged if idempotent else self._attempt
+                    response = await asyncio.wait_for(
+                        call(method, url, min(attempt_timeout, deadline - time.monotonic()), **kwargs),
+                        max(0.0, deadline - time.monotonic()),
+                    )
+                    if response.status < 500:
+                        return response
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    failure = err
+
+                retries += 1
+                delay = backoff_delay(retries)
+                if not idempotent or retries > self.retries or time.monotonic() + delay >= deadline:
+                    if failure is not None:
+                        raise UpstreamError(f"{self.name} request failed: {failure!r}") from failure
+                    return response
+                metrics.count(f"upstream.{self.name}.retries")
+                await asyncio.sleep(delay)
+                probe = self.breaker.check() or probe
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, timeout: float = None, **kwargs):
+        """
+        Send a request and hand back the raw aiohttp response so the body can be read incrementally
+
+        The concurrency slot is held until the caller leaves the context. The timeout bounds the whole stream.
+        Streams are never retried or hedged, a partly consumed body cannot be replayed.
+        """
+        probe = self.breaker.check()
+        try:
+            self._spend()
+            call_timeout = aiohttp.ClientTimeout(total=timeout if timeout is not None else self.timeout)
+            async with self._semaphore:
+                try:
+                    async with self.session().request(method, url, timeout=call_timeout, **kwargs) as response:
+                        self._record(response.status, response.headers)
+                        yield response
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    self.breaker.record_failure()
+                    raise UpstreamError(f"{self.name} stream failed: {err!r}") from err
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    async def post(self, url: str, **kwargs) -> UpstreamResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> UpstreamResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# one pool per upstream; LLM calls are slow so they get a longer timeout, trades get a short one
+# ASI-1 is budgeted in LLM tokens and Bitquery in requests; trades are never held back, so PumpPortal has no budget
+# the deadline bounds a whole call including retries; only Bitquery reads are retried by default, an LLM retry
+# costs a full completion and a trade must never be sent twice
+asi1 = Upstream(
+    "asi1",
+    concurrency=int(os.getenv("ASI1_CONCURRENCY", 16)),
+    timeout=float(os.getenv("ASI1_TIMEOUT", 60)),
+    deadline=float(os.getenv("ASI1_DEADLINE", 60)),
+    retries=int(os.getenv("ASI1_RETRIES", 0)),
+    budget=UpstreamBudget("asi1", float(os.getenv("ASI1_TOKENS_PER_MINUTE", 200000)), unit="tokens"),
+)
+bitquery = Upstream(
+    "bitquery",
+    concurrency=int(os.getenv("BITQUERY_CONCURRENCY", 8)),
+    timeout=float(os.getenv("BITQUERY_TIMEOUT", 10)),
+    deadline=float(os.getenv("BITQUERY_DEADLINE", 20)),
+    retries=int(os.getenv("BITQUERY_RETRIES", 2)),
+    budget=UpstreamBudget("bitquery", float(os.getenv("BITQUERY_REQUESTS_PER_MINUTE", 120))),
+)
+pumpportal = Upstream(
+    "pumpportal",
+    concurrency=int(os.getenv("PUMPPORTAL_CONCURRENCY", 4)),
+    timeout=float(os.getenv("PUMPPORTAL_TIMEOUT", 10)),
+    deadline=float(os.getenv("PUMPPORTAL_DEADLINE", 10)),
+)
+
+UPSTREAMS = {upstream.name: upstream for upstream in (asi1, bitquery, pumpportal)}
+
+
+async def close_all():
+    for upstream in UPSTREAMS.values():
+        await upstream.close()
@@ -0,0 +1,131 @@
+"""File Description
+
+    This module is the agent's in-process instrumentation. Pipeline stages (intent parse, Bitquery fetch, LLM
+    analysis, trade submit, ctx.send ...) are wrapped in span() timers that feed latency histograms, and count()
+    keeps counters for upstream errors, retries and similar events. snapshot() reports p50/p95/p99 per stage together
+    with the counters and any registered stats sources (caches, scheduler, order queue); agent.py serves it on the
+    /metrics REST endpoint and can log it periodically. When profiling is enabled, a sample of spans runs under
+    cProfile and the profiles of the ones slower than PROFILE_SLOW_MS are logged and kept for the /profiles endpoint.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# latency samples kept per stage for the percentiles
+HISTOGRAM_SAMPLES = int(os.getenv("HISTOGRAM_SAMPLES", 2048))
+# seconds between metrics dumps to the log, 0 disables them
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", 0))
+# fraction of profiled spans that actually run under cProfile, 0 disables profiling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 2000))
+PROFILES_KEPT = 20
+
+
+class Histogram:
+    """Latency distribution over the most recent samples, plus lifetime count and total"""
+
+    def __init__(self, samples: int = HISTOGRAM_SAMPLES):
+        self.samples = deque(maxlen=samples)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, level: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(level * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+        }
+
+
+histograms = {}
+counters = Counter()
+sources = {}
+slow_profiles = deque(maxlen=PROFILES_KEPT)
+_profiling = False
+
+
+def observe(stage: str, milliseconds: float):
+    histograms.setdefault(stage, Histogram()).observe(milliseconds)
+
+
+def count(name: str, amount: int = 1):
+    counters[name] += amount
+
+
+def register_source(name: str, stats):
+    """Include the dict returned by stats() under name in every snapshot"""
+    sources[name] = stats
+
+
+@contextmanager
+def span(stage: str, profile: bool = False):
+    """
+    Time the enclosed block into the stage's histogram; exceptions are counted as "<stage>.errors" and re-raised
+
+    With profile=True the block may be sampled for profiling (see PROFILE_SAMPLE_RATE). cProfile sees everything
+    running on the event loop meanwhile, so a profile shows what the loop was busy with during a slow request.
+    """
+    global _profiling
+    profiler = None
+    if profile and not _profiling and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        _profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count(f"{stage}.errors")
+        raise
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        observe(stage, elapsed)
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            if elapsed >= PROFILE_SLOW_MS:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+                slow_profiles.append({"stage": stage, "ms": elapsed, "at": time.time(), "profile": out.getvalue()})
+                logger.warning(f"Slow {stage} ({elapsed:.0f} ms) profiled:\n{out.getvalue()}")
+
+
+def profiles() -> list:
+    """The kept profiles of slow spans, newest first"""
+    return list(reversed(slow_profiles))
+
+
+def snapshot() -> dict:
+    report = {
+        "latency": {stage: histogram.summary() for stage, histogram in sorted(histograms.items())},
+        "counters": dict(sorted(counters.items())),
+        "slow_profiles": len(slow_profiles),
+    }
+    for name, stats in sources.items():
+        try:
+            report[name] = stats()
+        except Exception as err:
+            report[name] = {"error": str(err)}
+    return report
@@ -0,0 +1,212 @@
+"""File Description
+
+    This module is the trade execution pipeline in front of PumpPortal's trading API. Orders built from parsed buy/sell
+    commands go into a bounded queue and are submitted by a small pool of workers over a pre-warmed pooled connection.
+    Orders for the same wallet are serialized so they cannot race each other on-chain, an idempotency key (derived from
+    the chat message) makes sure a retried message never places the same order twice, and every order records how
+    long it spent being parsed, queued, submitted and answered. Slippage and priority fee can be set per order and
+    default to DEFAULT_SLIPPAGE / DEFAULT_PRIORITY_FEE.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from http_client import pumpportal
+from cache import TTLCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PUMPPORTAL_URL = os.getenv("PUMPPORTAL_URL", "https://pumpportal.fun")
+TRADE_ENDPOINT = f"{PUMPPORTAL_URL}/api/trade"
+apikey = PUMP_PORTAL_API_KEY
+
+DEFAULT_SLIPPAGE = float(os.getenv("DEFAULT_SLIPPAGE", 10))  # percent slippage allowed
+DEFAULT_PRIORITY_FEE = float(os.getenv("DEFAULT_PRIORITY_FEE", 0.0))  # SOL paid to land the transaction faster
+DEFAULT_POOL = os.getenv("DEFAULT_POOL", "auto")
+ORDER_QUEUE_SIZE = int(os.getenv("ORDER_QUEUE_SIZE", 100))
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", 4))
+# how long a finished order is remembered for its idempotency key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 600))
+
+
+class OrderQueueFull(Exception):
+    """Raised when the order queue is at ORDER_QUEUE_SIZE and a new order cannot be accepted"""
+
+
+class OrderOutcomeUnknown(Exception):
+    """Raised when an order failed after it may have reached PumpPortal, and for every resubmission of it within
+    IDEMPOTENCY_TTL: whether it was placed can only be told from the wallet, so it is never sent again"""
+
+
+class Order:
+    def __init__(self, action: str, mint: str, amount, slippage: float = None, priority_fee: float = None,
+                 pool: str = None, wallet: str = "default", idempotency_key: str = None, received_at: float = None):
+        self.action = action
+        self.mint = mint
+        self.amount = amount
+        self.slippage = DEFAULT_SLIPPAGE if slippage is None else slippage
+        self.priority_fee = DEFAULT_PRIORITY_FEE if priority_fee is None else priority_fee
+        self.pool = pool or DEFAULT_POOL
+        self.wallet = wallet
+        self.idempotency_key = idempotency_key
+        # monotonic timestamps, received_at is when the chat message arrived
+        self.received_at = received_at if received_at is not None else time.monotonic()
+        self.created_at = time.monotonic()
+        self.timings = {"parse_ms": (self.created_at - self.received_at) * 1000}
+
+    @classmethod
+    def from_command(cls, data: dict, **kwargs):
+        """Order from a parsed {"type", "address", "amount"} command, with optional "slippage" / "priority_fee"""
+        return cls(
+            action=data["type"],
+            mint=data["address"],
+            amount=data["amount"],
+            slippage=data.get("slippage"),
+            priority_fee=data.get("priority_fee"),
+            pool=data.get("pool"),
+            **kwargs,
+        )
+
+    def sell_percent(self) -> str:
+        """Sell amounts are a percentage of the position (see command_parser), PumpPortal takes them as e.g. 50%"""
+        amount = str(self.amount).strip().rstrip("%").strip()
+        return f"{float(amount):g}%"
+
+    def form(self) -> dict:
+        return {
+            "action": self.action,  # "buy" or "sell"
+            "mint": self.mint,  # contract address of the token you want to trade
+            "amount": self.amount if self.action == "buy" else self.sell_percent(),  # SOL to spend, or share of the position to sell
+            "denominatedInSol": "true" if self.action == "buy" else "false",  # "true" if amount is amount of SOL, "false" if amount is number of tokens
+            "slippage": self.slippage,  # percent slippage allowed
+            "priorityFee": self.priority_fee,  # amount used to enhance transaction speed
+            "pool": self.pool,  # exchange to trade on. "pump", "raydium", "pump-amm", "launchlab", "raydium-cpmm" or "auto"
+        }
+
+
+class OrderPipeline:
+    def __init__(self, queue_size: int = ORDER_QUEUE_SIZE, workers: int = ORDER_WORKERS):
+        self.queue_size = queue_size
+        self.worker_count = workers
+        self._queue = None
+        self._workers = []
+        self._wallet_locks = {}
+        self._results = TTLCache(ttl=IDEMPOTENCY_TTL, maxsize=10000)
+        # idempotency key -> error, for orders that failed or timed out with an unknown outcome
+        self._failed = TTLCache(ttl=IDEMPOTENCY_TTL, maxsize=10000)
+        self.submitted = 0
+        self.duplicates = 0
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.ensure_future(self._work()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def warm(self):
+        """Open (or refresh) a keep-alive connection to PumpPortal so the first order skips the TCP/TLS handshake"""
+        try:
+            await pumpportal.request("HEAD", PUMPPORTAL_URL, timeout=5)
+        except Exception as err:
+            logger.warning(f"Could not pre-warm PumpPortal connection: {err}")
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, order: Order) -> dict:
+        """
+        Queue an order and wait for PumpPortal's answer
+
+        Orders sharing an idempotency key within IDEMPOTENCY_TTL are placed once; later submissions get the first
+        order's result, or OrderOutcomeUnknown when the first order failed.
+
+        Returns:
+            PumpPortal response ({"signature", "errors"}) with the order's "timings" in milliseconds added
+
+        Raises:
+            OrderQueueFull: when the queue is full (the order was not sent and can be retried)
+            OrderOutcomeUnknown: when the order, or the first one with its idempotency key, failed or timed out
+        """
+        self.start()
+        key = order.idempotency_key
+        if key is None:
+            return await self._enqueue(order)
+
+        failure = self._failed.get(key)
+        if failure is not None:
+            self.duplicates += 1
+            logger.info(f"Duplicate of failed order {key} not resubmitted")
+            raise OrderOutcomeUnknown(f"order {key} failed earlier: {failure}")
+        if self._results.get(key) is not None or self._results.inflight(key):
+            self.duplicates += 1
+            logger.info(f"Duplicate order {key} ignored")
+        try:
+            return await self._results.get_or_fetch(key, lambda: self._enqueue(order))
+        except OrderQueueFull:
+            raise
+        except Exception as err:
+            self._failed.set(key, repr(err))
+            raise OrderOutcomeUnknown(f"order {key} failed: {err!r}") from err
+
+    async def _enqueue(self, order: Order) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((order, future, time.monotonic()))
+        except asyncio.QueueFull:
+            raise OrderQueueFull(f"{self.depth()} orders already pending")
+        return await future
+
+    async def _work(self):
+        while True:
+            order, future, queued_at = await self._queue.get()
+            try:
+                lock = self._wallet_locks.setdefault(order.wallet, asyncio.Lock())
+                async with lock:
+                    order.timings["queue_ms"] = (time.monotonic() - queued_at) * 1000
+                    result = await self._place(order)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as err:
+                if not future.done():
+                    future.set_exception(err)
+            finally:
+                self._queue.task_done()
+
+    async def _place(self, order: Order) -> dict:
+        submit_start = time.monotonic()
+        with metrics.span("trade_submit"):
+            response = await pumpportal.post(f"{TRADE_ENDPOINT}?api-key={apikey}", data=order.form())
+        response_start = time.monotonic()
+        resp = response.json()  # Tx signature or error(s)
+        done = time.monotonic()
+
+        self.submitted += 1
+        order.timings["submit_ms"] = (response_start - submit_start) * 1000
+        order.timings["response_ms"] = (done - response_start) * 1000
+        order.timings["total_ms"] = (done - order.received_at) * 1000
+        logger.info(f"{order.action} {order.mint} placed: " + ", ".join(f"{k}={v:.1f}" for k, v in order.timings.items()))
+        metrics.observe("trade_total", order.timings["total_ms"])
+        resp["timings"] = dict(order.timings)
+        return resp
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.depth(),
+            "workers": len(self._workers),
+            "submitted": self.submitted,
+            "duplicates": self.duplicates,
+            "failed": len(self._failed),
+        }
+
+
+order_pipeline = OrderPipeline()
@@ -8,60 +8,48 @@
     and quantiles, and handles HTTP calls with logging, error catching, and RFC‑3339 timestamping.
 """
 
-import requests
 import os
+import time
+import asyncio
 import logging
 import json
 import datetime
 from uagents import Model, Field
+from http_client import bitquery
+import metrics
+from cache import TTLCache
+import trade_stream
+import windows
+import store
+from resilience import UpstreamError
 
 #logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # bitquery endpoint for fetching memecoin data
-GRAPHQL_ENDPOINT = "https://streaming.bitquery.io/eap"
+GRAPHQL_ENDPOINT = os.getenv("BITQUERY_ENDPOINT", "https://streaming.bitquery.io/eap")
 
+# token metrics are cached per mint and time bucket, so a trending mint costs one Bitquery query per bucket
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", 30))
+METRICS_CACHE_SIZE = int(os.getenv("METRICS_CACHE_SIZE", 2048))
+metrics_cache = TTLCache(ttl=METRICS_CACHE_TTL, maxsize=METRICS_CACHE_SIZE)
+# last good metrics per mint, served past METRICS_CACHE_TTL while the Bitquery budget is low
+STALE_METRICS_MAX_AGE = float(os.getenv("STALE_METRICS_MAX_AGE", 300))
+stale_metrics = TTLCache(ttl=STALE_METRICS_MAX_AGE, maxsize=METRICS_CACHE_SIZE)
 
-class TokenRequest(Model):
-    prompt: str = Field(
-        description="Command from user",
-    )
-
-class AnalysisResponse(Model):
-    analysis: str = Field(
-        description="Expert Agent Response",
-    )
-
-# function to fetch and return memecoin data from bitquery
-async def get_memecoin_info_from_address(address: str) -> str:
-    """
-    Get info for a memecoin token using Bitquery
-    
-    Args:
-        address: Memecoin address
-        
-    Returns:
-        Formatted response string
-    """
-    
+# how many mints go into one batched query, bitquery rejects very large `in` filters and slow queries time out
+BITQUERY_BATCH_SIZE = int(os.getenv("BITQUERY_BATCH_SIZE", 25))
+# batch queries in flight at once for a paced (background) fetch
+BITQUERY_PACED_CONCURRENCY = int(os.getenv("BITQUERY_PACED_CONCURRENCY", 4))
 
-    try:
-        logger.info(f"Getting info for token: {address}")
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': BITQUERY_API_KEY
-        }
+# fetch the raw trades of the last hour once and compute 1m/5m/15m/1h metrics locally instead of the 15m aggregate
+MULTI_WINDOW_MODE = os.getenv("MULTI_WINDOW_MODE", "false").lower() == "true"
+# newest trades fetched per mint in multi-window mode; busier mints get their longer windows flagged as partial
+RAW_TRADES_LIMIT = int(os.getenv("RAW_TRADES_LIMIT", 10000))
 
-
-        query = """
-            query MyQuery($token: String!, $time_15min_ago: DateTime!) {
-                Solana(dataset: realtime) {
-                    DEXTradeByTokens(
-                    where: {Transaction: {Result: {Success: true}}, Trade: {Currency: {MintAddress: {is: $token}}, Market: {MarketAddress: {}}}, Block: {Time: {since: $time_15min_ago}}}
-                    limit: {count: 1}
-                    ) {
+# per-token metrics selected by both the single and the batched query; rows are grouped by Trade.Currency
+METRICS_FIELDS = """
                     Trade {
                         Currency {
                         Name
@@ -103,28 +91,375 @@ async def get_memecoin_info_from_address(address: str) -> str:
                         if: {Trade: {Side: {Type: {is: sell}}}, Block: {Time: {after: $time_15min_ago}}}
                     )
                     price_15min_allTimeHigh: quantile(of: Trade_PriceInUSD, level: 0.99)
+"""
+
+METRICS_QUERY = """
+            query MyQuery($token: String!, $time_15min_ago: DateTime!) {
+                Solana(dataset: realtime) {
+                    DEXTradeByTokens(
+                    where: {Transaction: {Result: {Success: true}}, Trade: {Currency: {MintAddress: {is: $token}}, Market: {MarketAddress: {}}}, Block: {Time: {since: $time_15min_ago}}}
+                    limit: {count: 1}
+                    ) {""" + METRICS_FIELDS + """
                     }
                 }
                 }
 
         """
 
-        time_15_minutes_ago = (datetime.datetime.now() - datetime.timedelta(minutes=15)).replace(microsecond=0).isoformat() + "Z"
+BATCH_METRICS_QUERY = """
+            query MyQuery($tokens: [String!], $count: Int!, $time_15min_ago: DateTime!) {
+                Solana(dataset: realtime) {
+                    DEXTradeByTokens(
+                    where: {Transaction: {Result: {Success: true}}, Trade: {Currency: {MintAddress: {in: $tokens}}, Market: {MarketAddress: {}}}, Block: {Time: {since: $time_15min_ago}}}
+                    limit: {count: $count}
+                    ) {""" + METRICS_FIELDS + """
+                    }
+                }
+                }
+
+        """
+
+RAW_TRADES_QUERY = """
+            query MyQuery($token: String!, $since: DateTime!, $limit: Int!) {
+                Solana(dataset: realtime) {
+                    DEXTradeByTokens(
+                    where: {Transaction: {Result: {Success: true}}, Trade: {Currency: {MintAddress: {is: $token}}}, Block: {Time: {since: $since}}}
+                    orderBy: {descending: Block_Time}
+                    limit: {count: $limit}
+                    ) {
+                    Block {
+                        Time
+                    }
+                    Transaction {
+                        Signer
+                    }
+                    Trade {
+                        Currency {
+                        Name
+                        MintAddress
+                        Symbol
+                        }
+                        PriceInUSD
+                        Side {
+                        Type
+                        AmountInUSD
+                        }
+                    }
+                    }
+                }
+                }
+
+        """
+
+
+class TokenRequest(Model):
+    prompt: str = Field(
+        description="Command from user",
+    )
+
+class AnalysisResponse(Model):
+    analysis: str = Field(
+        description="Expert Agent Response",
+    )
+
+# function to fetch and return memecoin data from bitquery
+async def get_memecoin_info_from_address(address: str) -> str:
+    """
+    Get info for a memecoin token using Bitquery, served from the metrics cache when a fresh copy exists
+    
+    Args:
+        address: Memecoin address
+        
+    Returns:
+        Formatted response string
+
+    Raises:
+        UpstreamError: when Bitquery failed or is unavailable and no usable metrics are at hand, so an error is never
+            passed on as if it were token data
+    """
+    # in streaming mode watched mints are served from the locally maintained rolling window
+    if trade_stream.ingestor is not None:
+        trade_stream.ingestor.watch(address)
+        local = trade_stream.ingestor.snapshot(address)
+        if local is not None:
+            return local
+
+    bucket = int(time.time() // METRICS_CACHE_TTL)
+    try:
+        return await metrics_cache.get_or_fetch((address, bucket), lambda: load_memecoin_info(address))
+    except UpstreamError as e:
+        logger.error(f"Could not get info for token {address}: {e}")
+        raise
+
+
+async def load_memecoin_info(address: str) -> str:
+    """
+    Memecoin info from the on-disk store when it holds a snapshot younger than METRICS_CACHE_TTL (e.g. right after a
+    restart), otherwise fetched from Bitquery and recorded in the store. While the Bitquery budget is low, metrics up
+    to STALE_METRICS_MAX_AGE old are served instead of a new query.
+
+    Args:
+        address: Memecoin address
+
+    Returns:
+        Raw JSON response text
+    """
+    stored = (await _load_stored([address])).get(address)
+    if stored is not None:
+        return stored
+    if bitquery.budget.low():
+        stale = (await _stale_memecoin_info([address])).get(address)
+        if stale is not None:
+            return stale
+
+    fetch = fetch_memecoin_info_multiwindow if MULTI_WINDOW_MODE else fetch_memecoin_info
+    info = await fetch(address)
+    stale_metrics.set(address, info)
+    if store.token_store is not None:
+        store.token_store.write_behind(store.token_store.record_metrics, address, info, time.time())
+    return info
+
+
+async def _stale_memecoin_info(addresses: list) -> dict:
+    """Last good metrics of each address up to STALE_METRICS_MAX_AGE old, from memory or the store"""
+    found = {address: stale_metrics.get(address) for address in addresses}
+    found.update(await _load_stored([address for address in addresses if found[address] is None], STALE_METRICS_MAX_AGE))
+    found = {address: info for address, info in found.items() if info is not None}
+    metrics.count("degraded.stale_metrics", len(found))
+    return found
+
+
+async def _load_stored(addresses: list, max_age: float = METRICS_CACHE_TTL) -> dict:
+    """Stored snapshots of the addresses that have one at most max_age old, read off the event loop"""
+    if store.token_store is None or not addresses:
+        return {}
+    stored = await asyncio.to_thread(lambda: {address: _stored_memecoin_info(address, max_age) for address in addresses})
+    stored = {address: info for address, info in stored.items() if info is not None}
+    metrics.count("store.hits", len(stored))
+    return stored
+
+
+def _stored_memecoin_info(address: str, max_age: float = METRICS_CACHE_TTL):
+    """Blocking read of one stored snapshot, see _load_stored"""
+    latest = store.token_store.latest_metrics(address, max_age=max_age)
+    if latest is None:
+        return None
+    info, at = latest
+    if MULTI_WINDOW_MODE:
+        # the other timeframes are recomputed from the stored trades as of the snapshot
+        columns = store.token_store.trade_columns(address, at - max(windows.WINDOWS.values()), at)
+        info = json.dumps(dict(json.loads(info), windows=windows.window_metrics(columns, at)))
+    return info
+
+
+def _time_15min_ago() -> str:
+    return _time_ago(15 * 60)
+
+
+def _time_ago(seconds: float) -> str:
+    return (datetime.datetime.now() - datetime.timedelta(seconds=seconds)).replace(microsecond=0).isoformat() + "Z"
+
+
+def _bitquery_data(response) -> dict:
+    """Parsed body of a Bitquery answer; error statuses, non-JSON bodies and failed queries raise UpstreamError"""
+    if response.status != 200:
+        raise UpstreamError(f"Bitquery returned {response.status}: {response.text[:200]}")
+    try:
+        body = response.json()
+    except ValueError:
+        raise UpstreamError(f"Bitquery returned a non-JSON body: {response.text[:200]}")
+    if body.get("errors") and not body.get("data"):
+        raise UpstreamError(f"Bitquery query failed: {body['errors'][0].get('message')}")
+    return body
+
+
+def _bitquery_headers() -> dict:
+    return {
+        'Content-Type': 'application/json',
+        'Authorization': BITQUERY_API_KEY
+    }
+
+
+async def fetch_memecoin_info(address: str) -> str:
+    """
+    Send the 15 minute metrics query for a memecoin token to Bitquery, bypassing the cache
+
+    Args:
+        address: Memecoin address
+
+    Returns:
+        Raw JSON response text
+
+    Raises:
+        UpstreamError: on an error status or a failed query
+    """
+    logger.info(f"Getting info for token: {address}")
+
+    variables = {
+        "token": address,
+        "time_15min_ago": _time_15min_ago()
+    }
 
-        variables = {
-            "token": address,
-            "time_15min_ago": time_15_minutes_ago
+    with metrics.span("bitquery_fetch"):
+        response = await bitquery.post(GRAPHQL_ENDPOINT, json={"query": METRICS_QUERY, "variables": variables}, headers=_bitquery_headers(), idempotent=True)
+
+    _bitquery_data(response)
+    return response.text
+
+
+async def fetch_memecoin_info_multiwindow(address: str) -> str:
+    """
+    Fetch the raw trades of a memecoin token over the widest window once and compute every window's metrics locally
+
+    Args:
+        address: Memecoin address
+
+    Returns:
+        JSON text shaped like the single-token response (its row holds the 15 minute metrics, so scoring and caching
+        work unchanged) with the per-window metrics under "windows"
+
+    Raises:
+        UpstreamError: on an error status or a failed query
+    """
+    logger.info(f"Getting trades for token: {address}")
+
+    now = time.time()
+    variables = {
+        "token": address,
+        "since": _time_ago(max(windows.WINDOWS.values())),
+        "limit": RAW_TRADES_LIMIT,
+    }
+
+    with metrics.span("bitquery_fetch_trades"):
+        response = await bitquery.post(GRAPHQL_ENDPOINT, json={"query": RAW_TRADES_QUERY, "variables": variables}, headers=_bitquery_headers(), idempotent=True)
+
+    rows = _bitquery_data(response).get("data", {}).get("Solana", {}).get("DEXTradeByTokens", []) or []
+    trades = [
+        {
+            "time": row["Block"]["Time"],
+            "signer": row["Transaction"]["Signer"],
+            "side": row["Trade"]["Side"]["Type"],
+            "amount_usd": row["Trade"]["Side"]["AmountInUSD"],
+            "price_usd": row["Trade"]["PriceInUSD"],
         }
+        for row in rows
+    ]
+    if store.token_store is not None:
+        store.token_store.write_behind(store.token_store.record_trades, address, trades)
+    columns = windows.trades_to_arrays(trades)
+    # at the row limit only the newest trades came back, so anything older than the oldest one is unknown
+    complete_since = float(columns["time"][0]) if len(rows) >= RAW_TRADES_LIMIT else None
+    per_window = windows.window_metrics(columns, now, complete_since=complete_since)
+
+    currency = rows[0]["Trade"]["Currency"] if rows else None
+    token_rows = [windows.to_bitquery_row(per_window["15m"], currency)] if per_window["15m"]["trades"] else []
+    return json.dumps({"data": {"Solana": {"DEXTradeByTokens": token_rows}}, "windows": per_window})
+
+
+async def fetch_memecoin_info_batch(addresses: list) -> dict:
+    """
+    Send one batched metrics query for up to BITQUERY_BATCH_SIZE tokens, bypassing the cache
+
+    Args:
+        addresses: Memecoin addresses
+
+    Returns:
+        Dict of address -> JSON text shaped like the single-token response
+
+    Raises:
+        UpstreamError: on an error status or a failed query
+    """
+    logger.info(f"Getting info for {len(addresses)} tokens")
+
+    variables = {
+        "tokens": list(addresses),
+        "count": len(addresses),
+        "time_15min_ago": _time_15min_ago()
+    }
+
+    with metrics.span("bitquery_fetch_batch"):
+        response = await bitquery.post(GRAPHQL_ENDPOINT, json={"query": BATCH_METRICS_QUERY, "variables": variables}, headers=_bitquery_headers(), idempotent=True)
+
+    rows = _bitquery_data(response).get("data", {}).get("Solana", {}).get("DEXTradeByTokens", []) or []
+    by_mint = {row["Trade"]["Currency"]["MintAddress"]: row for row in rows}
+
+    # re-wrap each row so downstream code sees exactly what a single-token query returns
+    return {
+        address: json.dumps({"data": {"Solana": {"DEXTradeByTokens": [by_mint[address]] if address in by_mint else []}}})
+        for address in addresses
+    }
+
+
+async def _fetch_paced(chunks: list) -> list:
+    """Run the batch queries a few at a time, each waiting until the Bitquery budget has room above its reserve"""
+    results = [None] * len(chunks)
+    pending = iter(range(len(chunks)))
+
+    async def work():
+        for i in pending:
+            # room for every paced query in flight, they are only charged once they are sent
+            await asyncio.sleep(bitquery.budget.headroom_wait(BITQUERY_PACED_CONCURRENCY))
+            try:
+                results[i] = await fetch_memecoin_info_batch(chunks[i])
+            except Exception as e:
+                results[i] = e
+
+    await asyncio.gather(*(work() for _ in range(min(len(chunks), BITQUERY_PACED_CONCURRENCY))))
+    return results
+
+
+async def get_memecoin_info_for_addresses(addresses: list, paced: bool = False) -> dict:
+    """
+    Get info for several memecoin tokens, fetching every cache miss in chunked batch queries
+
+    Args:
+        addresses: Memecoin addresses
+        paced: background fetch, the queries wait for Bitquery budget instead of all being sent at once, and never
+            spend the reserve that keeps interactive analyses from degrading
+
+    Returns:
+        Dict of address -> formatted response string, in the order the addresses were given; addresses whose
+        metrics could not be fetched map to the UpstreamError instead
+    """
+    addresses = list(dict.fromkeys(addresses))
+    bucket = int(time.time() // METRICS_CACHE_TTL)
+    results = {address: metrics_cache.get((address, bucket)) for address in addresses}
+    results.update(await _load_stored([address for address in addresses if results[address] is None]))
+    # mints already being fetched (e.g. speculatively by the chat handler) are joined rather than queried again
+    inflight = {
+        address: metrics_cache.inflight((address, bucket)) for address in addresses
+        if results[address] is None and metrics_cache.inflight((address, bucket)) is not None
+    }
+    if bitquery.budget.low():
+        results.update(await _stale_memecoin_info([
+            address for address in addresses if results[address] is None and address not in inflight
+        ]))
+    missing = [address for address in addresses if results[address] is None and address not in inflight]
+
+    chunks = [missing[i:i + BITQUERY_BATCH_SIZE] for i in range(0, len(missing), BITQUERY_BATCH_SIZE)]
+    if paced:
+        fetched = await _fetch_paced(chunks)
+    else:
+        fetched = await asyncio.gather(*(fetch_memecoin_info_batch(chunk) for chunk in chunks), return_exceptions=True)
 
-        response = requests.post(GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=headers)
+    for chunk, chunk_result in zip(chunks, fetched):
+        if isinstance(chunk_result, Exception):
+            logger.error(f"Could not get info for {len(chunk)} tokens: {chunk_result}")
+            error = chunk_result if isinstance(chunk_result, UpstreamError) else UpstreamError(str(chunk_result))
+            results.update({address: error for address in chunk})
+            continue
+        for address in chunk:
+            info = chunk_result[address]
+            metrics_cache.set((address, bucket), info)
+            stale_metrics.set(address, info)
+            if store.token_store is not None:
+                store.token_store.write_behind(store.token_store.record_metrics, address, info, time.time())
+            results[address] = info
 
-        if response.status_code == 200:
-            json_data = response.text
-            return json_data
-        else:
-            print(f"Error: {response.status_code}, {response.text}")
+    for address, task in inflight.items():
+        try:
+            results[address] = await asyncio.shield(task)
+        except Exception as e:
+            results[address] = e if isinstance(e, UpstreamError) else UpstreamError(str(e))
 
-    except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.error(error_msg)
-        return error_msg
+    return results
@@ -0,0 +1,226 @@
+"""File Description
+
+    This module holds the agent's rate limiting, all of it in memory. SenderLimiter gives every sender a token bucket
+    (by default 30 requests an hour, like the quota protocol it replaces) and is persisted to agent storage every few
+    seconds instead of on every request. UpstreamBudget tracks what the agent may still spend on an upstream (Bitquery
+    requests, ASI-1 tokens): its bucket is charged as calls are made, corrected from rate limit response headers,
+    and emptied with an exponential backoff on 429s. Callers ask low() before expensive work and degrade instead of
+    failing: stale metrics instead of a new Bitquery query, a cached briefing or the local summary instead of an LLM call.
+"""
+
+import email.utils
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+from resilience import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+# per-sender limit of the TokenRequest handler
+QUOTA_MAX_REQUESTS = int(os.getenv("QUOTA_MAX_REQUESTS", 30))
+QUOTA_WINDOW_MINUTES = float(os.getenv("QUOTA_WINDOW_MINUTES", 60))
+# seconds between writes of the sender buckets to agent storage
+RATE_LIMIT_PERSIST_INTERVAL = float(os.getenv("RATE_LIMIT_PERSIST_INTERVAL", 30))
+RATE_LIMIT_STORAGE_KEY = "rate_limits"
+# longest pause after repeated 429s when the upstream sends no Retry-After
+MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", 300))
+# with WORKER_PROCESSES > 0 the agent and every worker call the upstreams on their own, each spends an equal share
+UPSTREAM_BUDGET_SHARE = 1 / (1 + int(os.getenv("WORKER_PROCESSES", 0)))
+
+
+class BudgetExhausted(UpstreamError):
+    """Raised instead of calling an upstream that is backing off after a 429"""
+
+
+class TokenBucket:
+    """Classic token bucket on wall-clock time, so its state stays meaningful across restarts"""
+
+    def __init__(self, rate: float, capacity: float, tokens: float = None, updated_at: float = None):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def available(self, now: float = None) -> float:
+        now = time.time() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return self.tokens
+
+    def take(self, amount: float = 1.0) -> bool:
+        """Take amount tokens if they are all there"""
+        if self.available() < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def charge(self, amount: float):
+        """Spend amount tokens unconditionally, going into debt if the call cost more than was left"""
+        self.available()
+        self.tokens -= amount
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Seconds until amount tokens are available"""
+        missing = amount - self.available()
+        return max(0.0, missing / self.rate) if self.rate > 0 else float("inf")
+
+    def full(self) -> bool:
+        return self.available() >= self.capacity
+
+
+class SenderLimiter:
+    """Per-sender token buckets: max_requests per window, refilled continuously"""
+
+    def __init__(self, max_requests: int = QUOTA_MAX_REQUESTS, window_minutes: float = QUOTA_WINDOW_MINUTES,
+                 max_senders: int = 100000):
+        self.max_requests = max_requests
+        self.window_minutes = window_minutes
+        self.rate = max_requests / (window_minutes * 60)
+        self.max_senders = max_senders
+        self.buckets = OrderedDict()
+        self.rejected = 0
+        self._dirty = False
+
+    def _bucket(self, sender: str) -> TokenBucket:
+        bucket = self.buckets.get(sender)
+        if bucket is None:
+            bucket = self.buckets[sender] = TokenBucket(self.rate, self.max_requests)
+            while len(self.buckets) > self.max_senders:
+                # the least recently seen sender; worst case it gets a fresh bucket when it comes back
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(sender)
+        return bucket
+
+    def allow(self, sender: str) -> bool:
+        self._dirty = True
+        if self._bucket(sender).take():
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_after(self, sender: str) -> float:
+        return self._bucket(sender).wait_time()
+
+    def persist(self, storage):
+        """Write the buckets that are not full to storage, if anything changed since the last write"""
+        if not self._dirty:
+            return
+        storage.set(RATE_LIMIT_STORAGE_KEY, {
+            sender: [bucket.tokens, bucket.updated_at] for sender, bucket in self.buckets.items() if not bucket.full()
+        })
+        self._dirty = False
+
+    def restore(self, storage):
+        for sender, (tokens, updated_at) in (storage.get(RATE_LIMIT_STORAGE_KEY) or {}).items():
+            self.buckets[sender] = TokenBucket(self.rate, self.max_requests, tokens, updated_at)
+
+    def stats(self) -> dict:
+        return {"senders": len(self.buckets), "rejected": self.rejected}
+
+
+def _header(headers: dict, *names):
+    for name in names:
+        if name in headers:
+            return headers[name]
+    return None
+
+
+def _retry_after(value) -> float:
+    """Retry-After in seconds, from either delta-seconds or an HTTP date"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class UpstreamBudget:
+    """
+    What the agent may still spend on one upstream, in requests or LLM tokens
+
+    Args:
+        name: upstream name, for metrics
+        per_minute: refill rate, also the burst capacity until a rate limit header says otherwise
+        unit: "requests" (every call costs 1) or "tokens" (callers charge the usage reported by the LLM)
+        reserve: fraction of the capacity below which low() asks callers to degrade
+        share: fraction of the upstream's limit this process may use, rate limit headers are scaled by it too
+    """
+
+    def __init__(self, name: str, per_minute: float, unit: str = "requests", reserve: float = 0.2,
+                 share: float = UPSTREAM_BUDGET_SHARE):
+        self.name = name
+        self.unit = unit
+        self.reserve = reserve
+        self.share = share
+        self.bucket = TokenBucket(per_minute * share / 60, per_minute * share)
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.throttled = 0
+
+    @property
+    def request_cost(self) -> float:
+        return 1.0 if self.unit == "requests" else 0.0
+
+    def charge(self, amount: float):
+        self.bucket.charge(amount)
+
+    def blocked_for(self) -> float:
+        """Seconds left of the current 429 backoff"""
+        return max(0.0, self.blocked_until - time.time())
+
+    def low(self) -> bool:
+        return self.blocked_for() > 0 or self.bucket.available() < self.reserve * self.bucket.capacity
+
+    def headroom_wait(self, calls: int = 1) -> float:
+        """Seconds until `calls` background calls fit in the budget without spending the reserve kept for interactive
+        ones"""
+        return max(self.blocked_for(), self.bucket.wait_time(calls * self.request_cost + self.reserve * self.bucket.capacity))
+
+    def observe(self, status: int, headers: dict):
+        """Learn from a response: rate limit headers correct the bucket, a 429 empties it and starts a backoff"""
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        if self.unit == "tokens":
+            # the unsuffixed headers count requests, only the -tokens ones are in this budget's unit
+            limit = _header(headers, "x-ratelimit-limit-tokens")
+            remaining = _header(headers, "x-ratelimit-remaining-tokens")
+        else:
+            limit = _header(headers, "x-ratelimit-limit-requests", "x-ratelimit-limit", "ratelimit-limit")
+            remaining = _header(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining", "ratelimit-remaining")
+        try:
+            if limit is not None:
+                self.bucket.capacity = float(limit) * self.share
+            if remaining is not None:
+                self.bucket.available()
+                self.bucket.tokens = min(self.bucket.tokens, float(remaining) * self.share)
+        except ValueError:
+            pass
+
+        if status == 429:
+            self.throttled += 1
+            metrics.count(f"upstream.{self.name}.throttled")
+            self.backoff = min(MAX_BACKOFF, max(1.0, self.backoff * 2))
+            wait = _retry_after(_header(headers, "retry-after"))
+            self.blocked_until = time.time() + (wait if wait is not None else self.backoff)
+            self.bucket.available()
+            self.bucket.tokens = min(self.bucket.tokens, 0.0)
+            logger.warning(f"{self.name} rate limited, backing off for {self.blocked_for():.0f}s")
+        elif status < 400:
+            self.backoff = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "unit": self.unit,
+            "available": round(self.bucket.available(), 1),
+            "capacity": self.bucket.capacity,
+            "low": self.low(),
+            "blocked_for_s": round(self.blocked_for(), 1),
+            "throttled": self.throttled,
+        }
+
+
+sender_limiter = SenderLimiter()
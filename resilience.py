@@ -0,0 +1,108 @@
+"""File Description
+
+    This module holds the failure handling shared by every upstream client in http_client.py. A CircuitBreaker per
+    upstream counts consecutive failures (connection errors, timeouts and 5xx answers) and, past a threshold, fails
+    calls immediately for a cool-down period before letting a single probe through; this keeps handlers from piling up
+    on an upstream that is down. backoff_delay gives the jittered exponential pause between retries of idempotent
+    reads, and hedge_delay the point (a latency percentile of the upstream's recent calls) after which an idempotent
+    read gets a second, hedged request so one stalled connection does not set the tail latency.
+"""
+
+import logging
+import os
+import random
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# consecutive failures that open a circuit, and how long it stays open before a probe is let through
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+# retries of idempotent reads: full-jitter exponential backoff starting at RETRY_BASE_DELAY seconds
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.2))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 2.0))
+# an idempotent read still running at this percentile of the upstream's latency is hedged, 0 disables hedging
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 50))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", 50))
+
+
+class UpstreamError(Exception):
+    """An upstream call failed or returned an unusable answer"""
+
+
+class CircuitOpen(UpstreamError):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive failures -> half-open (one probe) after `reset_seconds`"""
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def check(self) -> bool:
+        """
+        Returns:
+            True when the call is the half-open probe; the caller must call release_probe once it is over
+
+        Raises:
+            CircuitOpen: while open, and for everyone but the one probe while half-open
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        metrics.count(f"upstream.{self.name}.fail_fast")
+        retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+        raise CircuitOpen(f"{self.name} is unavailable, retrying in {retry_in:.0f}s")
+
+    def record_success(self):
+        self.consecutive = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """End a probe that finished without recording an outcome (cancelled, past its deadline, rate limited),
+        so the next call probes instead of the circuit staying half-open with nobody let through"""
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive += 1
+        if self._probing or (self.opened_at is None and self.consecutive >= self.failures):
+            if self.opened_at is None:
+                logger.warning(f"{self.name} circuit opened after {self.consecutive} consecutive failures")
+                metrics.count(f"upstream.{self.name}.circuit_open")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based), in seconds"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def hedge_delay(name: str):
+    """Seconds after which a read from the upstream gets hedged, None until enough latency samples exist"""
+    histogram = metrics.histograms.get(f"upstream.{name}")
+    if not HEDGE_PERCENTILE or histogram is None or len(histogram.samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY_MS, histogram.percentile(HEDGE_PERCENTILE)) / 1000
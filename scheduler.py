@@ -0,0 +1,128 @@
+"""File Description
+
+    This module schedules chat work onto a bounded pool of async workers, so the message handler only acknowledges
+    and enqueues while the actual parsing, analysis and trading run with a fixed cap on in-flight upstream work.
+    Jobs have a priority (trades before LLM parsing before analyses) and within a priority senders are served round
+    robin, so one user pasting twenty addresses cannot starve everyone else. When the queue is at its depth limit new
+    jobs are rejected right away with SchedulerBusy, letting the handler answer "busy" instead of timing out.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# lower runs first
+PRIORITY_TRADE = 0
+PRIORITY_PARSE = 1
+PRIORITY_ANALYSIS = 2
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 16))
+SCHEDULER_MAX_QUEUED = int(os.getenv("SCHEDULER_MAX_QUEUED", 200))
+SCHEDULER_MAX_PER_SENDER = int(os.getenv("SCHEDULER_MAX_PER_SENDER", 10))
+
+
+class SchedulerBusy(Exception):
+    """Raised when a job cannot be queued because the scheduler or the sender's share of it is full"""
+
+
+class JobScheduler:
+    def __init__(self, workers: int = SCHEDULER_WORKERS, max_queued: int = SCHEDULER_MAX_QUEUED,
+                 max_per_sender: int = SCHEDULER_MAX_PER_SENDER):
+        self.worker_count = workers
+        self.max_queued = max_queued
+        self.max_per_sender = max_per_sender
+        # priority -> sender -> jobs; OrderedDict order is the round robin order of senders
+        self._queues = {priority: OrderedDict() for priority in (PRIORITY_TRADE, PRIORITY_PARSE, PRIORITY_ANALYSIS)}
+        self._per_sender = {}
+        self._queued = 0
+        self._running = 0
+        self._ready = None
+        self._workers = []
+        self.rejected = 0
+        self.completed = 0
+
+    def start(self):
+        if self._ready is None:
+            self._ready = asyncio.Semaphore(0)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.ensure_future(self._work()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def depth(self) -> int:
+        return self._queued
+
+    def submit(self, sender: str, priority: int, job, force: bool = False):
+        """
+        Queue a job
+
+        Args:
+            sender: address the job is for, used for fairness and the per-sender limit
+            priority: PRIORITY_TRADE, PRIORITY_PARSE or PRIORITY_ANALYSIS
+            job: zero-argument coroutine function
+            force: skip the depth limits, for follow-up work of a job that was already admitted
+
+        Raises:
+            SchedulerBusy: when the queue or the sender's share of it is full
+        """
+        self.start()
+        if not force:
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                raise SchedulerBusy(f"{self._queued} jobs queued")
+            if self._per_sender.get(sender, 0) >= self.max_per_sender:
+                self.rejected += 1
+                raise SchedulerBusy(f"{sender} already has {self._per_sender[sender]} jobs queued")
+
+        self._queues[priority].setdefault(sender, deque()).append(job)
+        self._per_sender[sender] = self._per_sender.get(sender, 0) + 1
+        self._queued += 1
+        self._ready.release()
+
+    def _next(self):
+        for senders in self._queues.values():
+            if senders:
+                sender, jobs = senders.popitem(last=False)
+                job = jobs.popleft()
+                if jobs:
+                    # the sender goes to the back of the line for its next job
+                    senders[sender] = jobs
+                self._per_sender[sender] -= 1
+                if not self._per_sender[sender]:
+                    del self._per_sender[sender]
+                self._queued -= 1
+                return sender, job
+
+    async def _work(self):
+        while True:
+            await self._ready.acquire()
+            sender, job = self._next()
+            self._running += 1
+            try:
+                await job()
+            except Exception as err:
+                logger.error(f"Job for {sender} failed: {err}")
+            finally:
+                self._running -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queued,
+            "running": self._running,
+            "workers": len(self._workers),
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "queued_by_priority": {priority: sum(map(len, senders.values())) for priority, senders in self._queues.items()},
+        }
+
+
+scheduler = JobScheduler()
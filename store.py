@@ -0,0 +1,280 @@
+"""File Description
+
+    This module is the optional on-disk history of everything fetched from Bitquery. Token metric snapshots and raw
+    trades are appended to per-mint, day-partitioned columnar files: each column of a partition is its own file of
+    fixed-width little-endian values (STORE_DIR/<metrics|trades>/<mint>/<day>/<column>), so appending a batch is one
+    write per column and reading a time range memory-maps just the columns and partitions it needs, without turning
+    rows into Python objects. query.py writes every fetch here and reads the latest snapshot back on a cache miss,
+    which gives the agent warm starts after a restart; offline tools such as the backtester scan the same files. Files
+    are only ever appended to; a write torn by a crash is cut back to the last complete row the next time it is used.
+    Every memory map holds a file descriptor, so only the most recently read partitions stay mapped, and lookups of the
+    newest row read it directly instead of mapping anything. The agent never touches the disk on its event loop: writes
+    go through a single write-behind thread (in order), reads through asyncio.to_thread.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from features import RAW_FIELDS, metrics_matrix, parse_rows
+from windows import to_bitquery_row
+
+logger = logging.getLogger(__name__)
+
+# directory of the store, empty (default) disables it
+STORE_DIR = os.getenv("STORE_DIR", "")
+PARTITION_SECONDS = 24 * 60 * 60
+# partitions kept memory-mapped per kind of record, each costs one file descriptor per column
+STORE_MAX_OPEN_PARTITIONS = int(os.getenv("STORE_MAX_OPEN_PARTITIONS", 16))
+
+# every kind has a "time" column (epoch seconds) first, rows are appended in time order
+METRIC_COLUMNS = {"time": "<f8", **{name: "<f8" for name in RAW_FIELDS}}
+TRADE_COLUMNS = {"time": "<f8", "price": "<f8", "amount": "<f8", "is_buy": "u1", "signer": "S44"}
+
+
+class ColumnStore:
+    """Append-only, time-partitioned, fixed-width columns for one kind of record, keyed by mint"""
+
+    def __init__(self, root: str, columns: dict, max_open: int = STORE_MAX_OPEN_PARTITIONS):
+        self.root = root
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.max_open = max_open
+        self._maps = OrderedDict()  # partition dir -> (rows, {column: memmap}), least recently read first
+        self._lock = threading.Lock()
+
+    def _partition(self, mint: str, day: int) -> str:
+        return os.path.join(self.root, mint, str(day))
+
+    def _rows(self, partition: str) -> int:
+        sizes = []
+        for name, dtype in self.columns.items():
+            path = os.path.join(partition, name)
+            sizes.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def _repair(self, partition: str, rows: int):
+        """Cut every column back to `rows` complete values after a torn append"""
+        for name, dtype in self.columns.items():
+            path = os.path.join(partition, name)
+            if os.path.exists(path) and os.path.getsize(path) != rows * dtype.itemsize:
+                logger.warning(f"Truncating torn column {path} to {rows} rows")
+                with open(path, "r+b") as file:
+                    file.truncate(rows * dtype.itemsize)
+
+    def partitions(self, mint: str) -> list:
+        """Days with data for a mint, oldest first"""
+        try:
+            return sorted(int(day) for day in os.listdir(os.path.join(self.root, mint)) if day.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def mints(self) -> list:
+        try:
+            return sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return []
+
+    def last_row(self, mint: str, columns=None):
+        """
+        Newest stored row of a mint, read straight from the files without mapping them
+
+        Returns:
+            column name -> value for the requested columns (all by default), or None when nothing is stored
+        """
+        columns = self.columns if columns is None else columns
+        for day in reversed(self.partitions(mint)):
+            partition = self._partition(mint, day)
+            rows = self._rows(partition)
+            if rows:
+                return {
+                    name: np.fromfile(os.path.join(partition, name), dtype=self.columns[name], count=1,
+                                      offset=(rows - 1) * self.columns[name].itemsize)[0]
+                    for name in columns
+                }
+        return None
+
+    def last_time(self, mint: str):
+        """Time of the newest stored row of a mint, or None"""
+        row = self.last_row(mint, ("time",))
+        return float(row["time"]) if row is not None else None
+
+    def append(self, mint: str, records: dict):
+        """
+        Append rows to a mint's partitions
+
+        Args:
+            records: column name -> 1-d array, all the same length and sorted by "time"
+        """
+        times = np.asarray(records["time"], dtype=np.float64)
+        if not len(times):
+            return
+        days = (times // PARTITION_SECONDS).astype(np.int64)
+        for day in np.unique(days):
+            partition = self._partition(mint, int(day))
+            os.makedirs(partition, exist_ok=True)
+            selected = days == day
+            with self._lock:
+                self._repair(partition, self._rows(partition))
+                for name, dtype in self.columns.items():
+                    with open(os.path.join(partition, name), "ab") as file:
+                        file.write(np.asarray(records[name])[selected].astype(dtype).tobytes())
+                self._maps.pop(partition, None)
+
+    def _open(self, partition: str):
+        """Memory-mapped columns of a partition, re-mapped only when it grew since the last read"""
+        if not os.path.isdir(partition):
+            return None
+        with self._lock:
+            rows = self._rows(partition)
+            cached = self._maps.get(partition)
+            if cached is not None and cached[0] == rows:
+                self._maps.move_to_end(partition)
+                return cached[1]
+            if rows == 0:
+                columns = {name: np.zeros(0, dtype=dtype) for name, dtype in self.columns.items()}
+            else:
+                columns = {
+                    name: np.memmap(os.path.join(partition, name), dtype=dtype, mode="r", shape=(rows,))
+                    for name, dtype in self.columns.items()
+                }
+            self._maps[partition] = (rows, columns)
+            self._maps.move_to_end(partition)
+            while len(self._maps) > self.max_open:
+                # the maps (and their descriptors) are released once no scan result still views them
+                self._maps.popitem(last=False)
+            return columns
+
+    def scan(self, mint: str, start: float, end: float = None) -> dict:
+        """
+        Rows of a mint with start <= time <= end
+
+        Returns:
+            column name -> array; a range inside one partition is a zero-copy view of the mapped files, ranges
+            spanning several partitions are concatenated
+        """
+        end = time.time() if end is None else end
+        first, last = int(start // PARTITION_SECONDS), int(end // PARTITION_SECONDS)
+        pieces = []
+        for day in self.partitions(mint):
+            if first <= day <= last:
+                columns = self._open(self._partition(mint, day))
+                low = np.searchsorted(columns["time"], start, side="left")
+                high = np.searchsorted(columns["time"], end, side="right")
+                if high > low:
+                    pieces.append({name: column[low:high] for name, column in columns.items()})
+        if not pieces:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in self.columns.items()}
+        if len(pieces) == 1:
+            return pieces[0]
+        return {name: np.concatenate([piece[name] for piece in pieces]) for name in self.columns}
+
+
+class TokenStore:
+    """Metric snapshots and raw trades per mint, plus the token's name/symbol"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.metrics = ColumnStore(os.path.join(root, "metrics"), METRIC_COLUMNS)
+        self.trades = ColumnStore(os.path.join(root, "trades"), TRADE_COLUMNS)
+        self._currencies = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-writer")
+
+    def write_behind(self, record, *args):
+        """Run a record_* call on the writer thread; writes keep their order and never block the caller"""
+        def _done(future):
+            if future.exception() is not None:
+                logger.error(f"Store write failed: {future.exception()!r}")
+        self._writer.submit(record, *args).add_done_callback(_done)
+
+    def flush(self):
+        """Wait for the writes queued so far"""
+        self._writer.submit(lambda: None).result()
+
+    def _currency_path(self, mint: str) -> str:
+        return os.path.join(self.root, "currencies", f"{mint}.json")
+
+    def currency(self, mint: str) -> dict:
+        if mint not in self._currencies:
+            try:
+                with open(self._currency_path(mint)) as file:
+                    self._currencies[mint] = json.load(file)
+            except (FileNotFoundError, ValueError):
+                return {"MintAddress": mint}
+        return self._currencies[mint]
+
+    def record_metrics(self, mint: str, token_info: str, at: float = None):
+        """Append the metrics row of a Bitquery response (ignored when it holds none)"""
+        rows = parse_rows(token_info)
+        if not rows:
+            return
+        at = time.time() if at is None else at
+        if mint not in self._currencies and not os.path.exists(self._currency_path(mint)):
+            os.makedirs(os.path.dirname(self._currency_path(mint)), exist_ok=True)
+            with open(self._currency_path(mint), "w") as file:
+                json.dump((rows[0].get("Trade") or {}).get("Currency") or {}, file)
+        raw = metrics_matrix(rows[:1])[0]
+        self.metrics.append(mint, {"time": [at], **{name: [raw[index]] for index, name in enumerate(RAW_FIELDS)}})
+
+    def record_trades(self, mint: str, trades: list):
+        """
+        Append trades newer than the newest stored one
+
+        Overlapping fetches (every multi-window fetch covers the last hour) only add what is new. Trades sharing the
+        newest stored second with a later fetch are skipped, Bitquery block times have one second resolution.
+        """
+        if not trades:
+            return
+        times = np.array([trade["time"].rstrip("Z") for trade in trades], dtype="datetime64[ms]").astype(np.int64) / 1000.0
+        order = np.argsort(times, kind="stable")
+        last = self.trades.last_time(mint)
+        keep = order[times[order] > last] if last is not None else order
+        if not len(keep):
+            return
+        self.trades.append(mint, {
+            "time": times[keep],
+            "price": np.array([float(trades[i]["price_usd"] or 0) for i in keep]),
+            "amount": np.array([float(trades[i]["amount_usd"] or 0) for i in keep]),
+            "is_buy": np.array([trades[i]["side"] == "buy" for i in keep]),
+            "signer": np.array([trades[i]["signer"] for i in keep], dtype="S44"),
+        })
+
+    def trade_columns(self, mint: str, start: float, end: float = None) -> dict:
+        """Stored trades of a mint in the column layout of windows.trades_to_arrays"""
+        stored = self.trades.scan(mint, start, end)
+        _, signer_codes = np.unique(stored["signer"], return_inverse=True)
+        return {
+            "time": stored["time"],
+            "price": stored["price"],
+            "amount": stored["amount"],
+            "is_buy": stored["is_buy"].astype(bool),
+            "signer": signer_codes,
+        }
+
+    def latest_metrics(self, mint: str, max_age: float, now: float = None):
+        """
+        Newest stored metrics of a mint as a Bitquery response
+
+        Returns:
+            (JSON text, snapshot time), or None when nothing at most max_age seconds old is stored
+        """
+        now = time.time() if now is None else now
+        latest = self.metrics.last_row(mint)
+        if latest is None or not now - max_age <= latest["time"] <= now:
+            return None
+        raw = {name: float(latest[name]) for name in RAW_FIELDS}
+        counts = ("makers", "buyers", "sellers", "trades", "buys", "sells")
+        row = to_bitquery_row({
+            **{name: int(raw[name]) for name in counts},
+            "volume": raw["volume"], "buy_volume": raw["buy_volume"], "sell_volume": raw["sell_volume"],
+            "open": raw["start"], "close": raw["end"], "p99": raw["p99"],
+        }, self.currency(mint))
+        return json.dumps({"data": {"Solana": {"DEXTradeByTokens": [row]}}}), float(latest["time"])
+
+
+token_store = TokenStore(STORE_DIR) if STORE_DIR else None
@@ -0,0 +1,10 @@
+import builtins
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Agentverse injects the secrets as builtins, modules read them at import time
+for name in ("AGENTVERSE_API_KEY", "BITQUERY_API_KEY", "PUMP_PORTAL_API_KEY"):
+    if not hasattr(builtins, name):
+        setattr(builtins, name, "test")
@@ -0,0 +1,53 @@
+from command_parser import parse_command
+
+MINT = "DezXAZ8z7PnrnRJjz3wXBoRgixCa6xjnB7YaB1pPB263"
+OTHER = "EPjFWdd5AufqSSqeM2qFxEKSxpbz6HFRBhmdmCHTZ8ZC"
+
+
+def test_buy_in_sol():
+    assert parse_command(f"buy 0.1 sol of {MINT}") == {"type": "buy", "address": MINT, "amount": 0.1}
+    assert parse_command(f"please ape 2 SOL into {MINT}") == {"type": "buy", "address": MINT, "amount": 2.0}
+    assert parse_command(f"buy 0.5 of {MINT}") == {"type": "buy", "address": MINT, "amount": 0.5}
+
+
+def test_buy_with_settings():
+    assert parse_command(f"buy 0.1 sol of {MINT} slippage 15% priority fee 0.0005") == {
+        "type": "buy", "address": MINT, "amount": 0.1, "slippage": 15.0, "priority_fee": 0.0005,
+    }
+
+
+def test_buy_in_other_units_goes_to_the_llm():
+    assert parse_command(f"buy 1000 tokens of {MINT}") is None
+    assert parse_command(f"buy 5 usdc of {MINT}") is None
+    assert parse_command(f"buy $20 of {MINT}") is None
+    assert parse_command(f"buy 10% of {MINT}") is None
+
+
+def test_sell_percentages():
+    assert parse_command(f"sell 50% of {MINT}") == {"type": "sell", "address": MINT, "amount": 50.0}
+    assert parse_command(f"sell half of my {MINT} bag") == {"type": "sell", "address": MINT, "amount": 50}
+    assert parse_command(f"dump all my {MINT}") == {"type": "sell", "address": MINT, "amount": 100}
+
+
+def test_sell_without_a_percentage_goes_to_the_llm():
+    assert parse_command(f"sell 50 {MINT}") is None
+    assert parse_command(f"sell 50 tokens of {MINT}") is None
+    assert parse_command(f"sell 120% of {MINT}") is None
+
+
+def test_ambiguous_trades_go_to_the_llm():
+    assert parse_command(f"don't buy 0.1 sol of {MINT}") is None
+    assert parse_command(f"should I buy 0.1 sol of {MINT}?") is None
+    assert parse_command(f"buy 0.1 sol of {MINT} and {OTHER}") is None
+    assert parse_command(f"buy 0.1 sol or 0.2 sol of {MINT}") is None
+    assert parse_command(f"buy 0.1 sol of {MINT} if it dips") is None
+
+
+def test_analysis_and_watch():
+    assert parse_command(f"analyze {MINT}") == {"type": "analysis", "address": MINT, "amount": "none"}
+    assert parse_command(f"is {MINT} safe?")["type"] == "analysis"
+    assert parse_command(f"check {MINT} and {OTHER}")["addresses"] == [MINT, OTHER]
+    assert parse_command(f"watch {MINT}") == {"type": "watch", "address": MINT, "addresses": [MINT]}
+    assert parse_command(f"stop watching {MINT}")["type"] == "unwatch"
+    assert parse_command("watchlist") == {"type": "watchlist"}
+    assert parse_command("buy 0.1 sol of something") is None
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+import orders
+from orders import Order, OrderOutcomeUnknown, OrderPipeline
+
+
+def test_failed_order_is_not_resubmitted(monkeypatch):
+    calls = []
+
+    async def post(url, **kwargs):
+        calls.append(url)
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(orders.pumpportal, "post", post)
+
+    async def main():
+        pipeline = OrderPipeline()
+        for _ in range(2):
+            with pytest.raises(OrderOutcomeUnknown):
+                await pipeline.submit(Order("buy", "A", 0.1, idempotency_key="sender:msg:0"))
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(main())
+    assert len(calls) == 1
+    assert pipeline.duplicates == 1
+
+
+def test_sell_amount_is_sent_as_a_percentage():
+    assert Order("sell", "A", 50).form()["amount"] == "50%"
+    assert Order("sell", "A", "12.5%").form()["amount"] == "12.5%"
+    assert Order("buy", "A", 0.1).form()["amount"] == 0.1
@@ -0,0 +1,27 @@
+import asyncio
+import json
+
+import query
+from http_client import bitquery
+from ratelimit import UpstreamBudget
+
+
+def test_paced_fetch_keeps_the_budget_reserve(monkeypatch):
+    budget = UpstreamBudget("bitquery", 120, share=1)
+    budget.bucket.rate = 100.0  # refill fast, the test only checks the floor
+    monkeypatch.setattr(bitquery, "budget", budget)
+    available = []
+
+    async def fetch(chunk):
+        budget.charge(budget.request_cost)
+        available.append(budget.bucket.available())
+        await asyncio.sleep(0.01)
+        return {address: json.dumps({"data": {"Solana": {"DEXTradeByTokens": []}}}) for address in chunk}
+
+    monkeypatch.setattr(query, "fetch_memecoin_info_batch", fetch)
+    addresses = [f"mint{i}" for i in range(200 * query.BITQUERY_BATCH_SIZE)]
+    results = asyncio.run(query.get_memecoin_info_for_addresses(addresses, paced=True))
+
+    assert len(results) == len(addresses)
+    assert len(available) == 200
+    assert min(available) >= budget.reserve * budget.bucket.capacity - 1e-6
@@ -0,0 +1,19 @@
+from ratelimit import UpstreamBudget
+
+
+def test_token_budget_ignores_request_headers():
+    budget = UpstreamBudget("asi1", 200000, unit="tokens", share=1)
+    budget.observe(200, {"X-RateLimit-Limit": "60", "X-RateLimit-Remaining": "59"})
+    assert budget.bucket.capacity == 200000
+    assert not budget.low()
+
+    budget.observe(200, {"X-RateLimit-Limit-Tokens": "100000", "X-RateLimit-Remaining-Tokens": "90000"})
+    assert budget.bucket.capacity == 100000
+    assert round(budget.bucket.available()) == 90000
+
+
+def test_request_budget_accepts_unsuffixed_headers():
+    budget = UpstreamBudget("bitquery", 120, share=1)
+    budget.observe(200, {"X-RateLimit-Limit": "60", "X-RateLimit-Remaining": "10"})
+    assert budget.bucket.capacity == 60
+    assert budget.bucket.available() < 11
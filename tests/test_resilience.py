@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import pytest
+
+from http_client import Upstream
+from resilience import CircuitOpen, UpstreamError
+
+
+def _half_open(upstream):
+    upstream.breaker.consecutive = upstream.breaker.failures
+    upstream.breaker.opened_at = time.monotonic() - upstream.breaker.reset_seconds - 1
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    upstream = Upstream("test")
+    _half_open(upstream)
+
+    async def stalled(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    upstream._attempt = stalled
+
+    async def main():
+        probe = asyncio.ensure_future(upstream.get("http://upstream.test"))
+        await asyncio.sleep(0)
+        # everyone but the probe fails fast while it runs
+        with pytest.raises(CircuitOpen):
+            upstream.breaker.check()
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+
+    asyncio.run(main())
+    assert upstream.breaker.state == "half-open"
+    assert upstream.breaker.check() is True
+
+
+def test_probe_past_its_deadline_lets_the_next_call_probe():
+    upstream = Upstream("test", timeout=0.05)
+    _half_open(upstream)
+
+    async def stalled(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    upstream._attempt = stalled
+
+    async def main():
+        with pytest.raises(UpstreamError):
+            await upstream.get("http://upstream.test")
+
+    asyncio.run(main())
+    assert upstream.breaker.check() is True
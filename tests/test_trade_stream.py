@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import pytest
+
+import trade_stream
+from trade_stream import BitqueryStreamSource, ReplayFileSource, TradeStreamIngestor
+
+START = 1_746_100_800  # 2025-05-01T12:00:00Z
+
+
+def _trade(offset, mint="A", signer="s1", side="buy", amount=10.0, price=1.0):
+    return {"time": START + offset, "mint": mint, "signer": signer, "side": side, "amount_usd": amount, "price_usd": price}
+
+
+def _write_replay(path, trades):
+    with open(path, "w") as replay:
+        for trade in trades:
+            replay.write(json.dumps(trade) + "\n")
+    return str(path)
+
+
+def _row(ingestor, mint):
+    snapshot = ingestor.snapshot(mint)
+    assert snapshot is not None
+    rows = json.loads(snapshot)["data"]["Solana"]["DEXTradeByTokens"]
+    return rows[0] if rows else None
+
+
+def test_replay_matches_15m_metrics(tmp_path):
+    trades = [
+        _trade(0, signer="early", price=0.5),  # expires before the snapshot
+        _trade(400, signer="s1", side="buy", amount=10, price=1.0),
+        _trade(500, signer="s2", side="sell", amount=4, price=1.2),
+        _trade(600, mint="B", signer="s9", amount=99),  # not watched
+        _trade(950, signer="s1", side="buy", amount=6, price=1.1),
+        _trade(1000, signer="s3", side="sell", amount=2, price=0.9),
+    ]
+    ingestor = TradeStreamIngestor(ReplayFileSource(_write_replay(tmp_path / "trades.jsonl", trades)))
+    ingestor.watch("A")
+    asyncio.run(ingestor.run())
+
+    row = _row(ingestor, "A")
+    assert row["trades_15min"] == "4"
+    assert (row["buys_15min"], row["sells_15min"]) == ("2", "2")
+    assert (row["makers_15min"], row["buyers_15min"], row["sellers_15min"]) == ("3", "1", "2")
+    assert float(row["buy_volume_15min"]) == 16 and float(row["sell_volume_15min"]) == 6
+    assert (row["Trade"]["start"], row["Trade"]["end"]) == (1.0, 0.9)
+    assert row["price_15min_allTimeHigh"] == pytest.approx(1.2, rel=0.01)
+    assert ingestor.snapshot("B") is None
+
+
+def test_not_served_before_a_full_window(tmp_path):
+    trades = [_trade(offset) for offset in range(0, 600, 60)]
+    ingestor = TradeStreamIngestor(ReplayFileSource(_write_replay(tmp_path / "trades.jsonl", trades)))
+    ingestor.watch("A")
+    asyncio.run(ingestor.run())
+    assert not ingestor.is_warm("A")
+    assert ingestor.snapshot("A") is None
+
+
+class FlakySource:
+    """Yields the first batch, fails, then yields the second batch on the restart"""
+
+    def __init__(self, first, second):
+        self.batches = [first, second]
+        self.now = None
+
+    def watch(self, mints):
+        pass
+
+    def clock(self):
+        return self.now
+
+    async def trades(self):
+        batch = self.batches.pop(0)
+        for trade in batch:
+            self.now = trade["time"]
+            yield trade
+        if self.batches:
+            raise KeyError("payload")
+
+
+def test_failure_restarts_ingestion_and_resets_warmth():
+    first = [_trade(offset) for offset in range(0, 1000, 100)]
+    second = [_trade(offset) for offset in range(1000, 1300, 100)]
+    ingestor = TradeStreamIngestor(FlakySource(first, second))
+    ingestor.watch("A")
+    asyncio.run(ingestor.run())
+
+    assert ingestor.restarts == 1
+    assert ingestor.ingested == len(first) + len(second)
+    # the trades after the restart do not cover a full window yet
+    assert ingestor.snapshot("A") is None
+
+
+def test_evict_idle_unwatches_in_one_resubscribe(monkeypatch):
+    source = ReplayFileSource("unused")
+    calls = []
+    monkeypatch.setattr(source, "watch", lambda mints: calls.append(sorted(mints)))
+    ingestor = TradeStreamIngestor(source, idle_seconds=60)
+    for mint in ("A", "B", "C"):
+        ingestor.watch(mint)
+    ingestor.last_used["A"] -= 120
+    ingestor.last_used["B"] -= 120
+    calls.clear()
+
+    assert ingestor.evict_idle() == 2
+    assert calls == [["C"]]
+    assert list(ingestor.watched_since) == ["C"]
+
+
+def test_quiet_subscription_picks_up_new_mints(monkeypatch):
+    monkeypatch.setattr(trade_stream, "STREAM_RESUBSCRIBE_DELAY", 0.01)
+    subscribed = []
+
+    async def quiet_subscription(mints):
+        subscribed.append(mints)
+        await asyncio.Event().wait()
+        yield
+
+    async def scenario():
+        source = BitqueryStreamSource(api_key="test")
+        monkeypatch.setattr(source, "_subscribe", quiet_subscription)
+        ingestor = TradeStreamIngestor(source)
+        ingestor.watch("A")
+        ingestor.start()
+        await asyncio.sleep(0.05)
+        ingestor.watch("B")
+        await asyncio.sleep(0.1)
+        await ingestor.stop()
+
+    asyncio.run(scenario())
+    assert subscribed == [["A"], ["A", "B"]]
+
+
+def test_no_subscription_without_watched_mints(monkeypatch):
+    monkeypatch.setattr(trade_stream, "STREAM_RESUBSCRIBE_DELAY", 0.01)
+    subscribed = []
+
+    async def quiet_subscription(mints):
+        subscribed.append(mints)
+        await asyncio.Event().wait()
+        yield
+
+    async def scenario():
+        source = BitqueryStreamSource(api_key="test")
+        monkeypatch.setattr(source, "_subscribe", quiet_subscription)
+        ingestor = TradeStreamIngestor(source)
+        ingestor.watch("A")
+        ingestor.start()
+        await asyncio.sleep(0.05)
+        ingestor.unwatch("A")
+        await asyncio.sleep(0.1)
+        ingestor.watch("B")
+        await asyncio.sleep(0.1)
+        await ingestor.stop()
+
+    asyncio.run(scenario())
+    assert subscribed == [["A"], ["B"]]
@@ -0,0 +1,410 @@
+"""File Description
+
+    This module is the optional streaming mode for token metrics. Instead of asking Bitquery to aggregate the last
+    15 minutes of trades on every analysis, a TradeStreamIngestor subscribes to the trade stream for watched mints
+    and keeps the same metrics query.py selects (makers, buyers, sellers, trade counts, buy/sell volume, start/end
+    price and an approximate p99 price) up to date in memory, one RollingWindow ring buffer per mint. Reading a
+    snapshot is a dictionary lookup, and it is returned in the exact JSON shape of a Bitquery response so the rest of
+    the pipeline does not care where the numbers came from. Trade sources are pluggable: BitqueryStreamSource talks
+    to the live GraphQL subscription endpoint, ReplayFileSource replays a JSONL file of trades for tests and offline runs.
+    The ingest loop restarts the source after a failure and treats the outage as a gap: windows are only served again
+    once they have filled for a full window after it. Mints nobody asked about for a while are unsubscribed.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter, deque
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# "off" (default), "bitquery" for the live subscription, or "replay:<path>" to replay a JSONL trade file
+TRADE_STREAM_MODE = os.getenv("TRADE_STREAM_MODE", "off")
+STREAM_ENDPOINT = os.getenv("BITQUERY_STREAM_ENDPOINT", "wss://streaming.bitquery.io/eap")
+WINDOW_SECONDS = 15 * 60
+# ring buffer bound per mint, the oldest trades are dropped first if a mint trades faster than this
+MAX_TRADES_PER_MINT = int(os.getenv("MAX_TRADES_PER_MINT", 50000))
+# relative width of the price histogram buckets used for the p99 estimate (1% error)
+PRICE_BUCKET_RATIO = 1.01
+# watches made within this many seconds of each other share one resubscribe
+STREAM_RESUBSCRIBE_DELAY = float(os.getenv("STREAM_RESUBSCRIBE_DELAY", 2))
+# mints nobody asked about for this long are unsubscribed
+STREAM_IDLE_SECONDS = float(os.getenv("STREAM_IDLE_SECONDS", 3600))
+# longest pause before the ingest loop restarts after a failure
+STREAM_MAX_RESTART_DELAY = float(os.getenv("STREAM_MAX_RESTART_DELAY", 60))
+
+
+def _parse_time(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class RollingWindow:
+    """Incrementally maintained 15 minute metrics for one mint"""
+
+    def __init__(self, window_seconds: float = WINDOW_SECONDS, max_trades: int = MAX_TRADES_PER_MINT):
+        self.window_seconds = window_seconds
+        self.trades = deque()
+        self.max_trades = max_trades
+        self.currency = {}
+        self.makers = Counter()
+        self.buyers = Counter()
+        self.sellers = Counter()
+        self.buys = 0
+        self.sells = 0
+        self.buy_volume = 0.0
+        self.sell_volume = 0.0
+        self.price_buckets = Counter()
+
+    def _bucket(self, price: float) -> int:
+        return math.floor(math.log(price) / math.log(PRICE_BUCKET_RATIO))
+
+    def _apply(self, trade: dict, sign: int):
+        signer = trade["signer"]
+        self.makers[signer] += sign
+        if self.makers[signer] <= 0:
+            del self.makers[signer]
+        if trade["side"] == "buy":
+            self.buys += sign
+            self.buy_volume += sign * trade["amount_usd"]
+            side_signers = self.buyers
+        else:
+            self.sells += sign
+            self.sell_volume += sign * trade["amount_usd"]
+            side_signers = self.sellers
+        side_signers[signer] += sign
+        if side_signers[signer] <= 0:
+            del side_signers[signer]
+        if trade["price_usd"] > 0:
+            bucket = self._bucket(trade["price_usd"])
+            self.price_buckets[bucket] += sign
+            if self.price_buckets[bucket] <= 0:
+                del self.price_buckets[bucket]
+
+    def add(self, trade: dict):
+        if trade.get("name") or trade.get("symbol"):
+            self.currency = {"Name": trade.get("name"), "MintAddress": trade["mint"], "Symbol": trade.get("symbol")}
+        if len(self.trades) >= self.max_trades:
+            self._apply(self.trades.popleft(), -1)
+        self.trades.append(trade)
+        self._apply(trade, 1)
+        self.expire(trade["time"])
+
+    def expire(self, now: float):
+        cutoff = now - self.window_seconds
+        while self.trades and self.trades[0]["time"] < cutoff:
+            self._apply(self.trades.popleft(), -1)
+
+    def quantile(self, level: float):
+        total = sum(self.price_buckets.values())
+        if not total:
+            return None
+        target = level * total
+        seen = 0
+        for bucket in sorted(self.price_buckets):
+            seen += self.price_buckets[bucket]
+            if seen >= target:
+                # middle of the bucket in log space
+                return PRICE_BUCKET_RATIO ** (bucket + 0.5)
+
+    def snapshot(self) -> dict:
+        """Current metrics as one DEXTradeByTokens row, with the same aliases as the Bitquery query"""
+        return {
+            "Trade": {
+                "Currency": self.currency,
+                "start": self.trades[0]["price_usd"] if self.trades else None,
+                "end": self.trades[-1]["price_usd"] if self.trades else None,
+            },
+            "makers_15min": str(len(self.makers)),
+            "buyers_15min": str(len(self.buyers)),
+            "sellers_15min": str(len(self.sellers)),
+            "trades_15min": str(self.buys + self.sells),
+            "traded_volume_15min": str(self.buy_volume + self.sell_volume),
+            "buy_volume_15min": str(self.buy_volume),
+            "sell_volume_15min": str(self.sell_volume),
+            "buys_15min": str(self.buys),
+            "sells_15min": str(self.sells),
+            "price_15min_allTimeHigh": self.quantile(0.99),
+        }
+
+
+class ReplayFileSource:
+    """
+    Replays trades from a JSONL file, one trade per line:
+    {"time": "2025-05-01T12:00:00Z", "mint": ..., "signer": ..., "side": "buy", "amount_usd": 12.5, "price_usd": 0.0001}
+
+    Metrics are computed against the replayed event time, so replays are deterministic.
+    """
+
+    def __init__(self, path: str, speed: float = 0):
+        self.path = path
+        self.speed = speed  # 0 replays as fast as possible, 1 in real time, 10 ten times faster ...
+        self._now = None
+
+    def watch(self, mints):
+        pass
+
+    def clock(self):
+        return self._now
+
+    async def trades(self):
+        previous = None
+        with open(self.path) as replay:
+            for line in replay:
+                if not line.strip():
+                    continue
+                trade = json.loads(line)
+                trade["time"] = _parse_time(trade["time"])
+                if self.speed and previous is not None:
+                    await asyncio.sleep(max(0.0, trade["time"] - previous) / self.speed)
+                previous = trade["time"]
+                self._now = trade["time"] if self._now is None else max(self._now, trade["time"])
+                yield trade
+                await asyncio.sleep(0)
+
+
+SUBSCRIPTION = """
+    subscription ($tokens: [String!]) {
+        Solana {
+            DEXTradeByTokens(
+            where: {Transaction: {Result: {Success: true}}, Trade: {Currency: {MintAddress: {in: $tokens}}}}
+            ) {
+            Block { Time }
+            Transaction { Signer }
+            Trade {
+                Currency { Name MintAddress Symbol }
+                PriceInUSD
+                Side { Type AmountInUSD }
+            }
+            }
+        }
+    }
+"""
+
+
+class BitqueryStreamSource:
+    """Live trades from Bitquery's GraphQL subscription endpoint (graphql-transport-ws)"""
+
+    def __init__(self, endpoint: str = STREAM_ENDPOINT, api_key: str = None):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.mints = set()
+        self._changed = asyncio.Event()
+
+    def watch(self, mints):
+        mints = set(mints)
+        if mints != self.mints:
+            self.mints = mints
+            self._changed.set()
+
+    def clock(self) -> float:
+        return time.time()
+
+    async def trades(self):
+        """
+        Trades of the watched mints; a change of the watched set switches to a new subscription even while the
+        current one is quiet. Disconnects are raised for the ingestor to handle, it knows the windows have a gap.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # with nothing watched there is nothing to subscribe to, an empty filter would be every trade on Solana
+            while not self.mints:
+                self._changed.clear()
+                await self._changed.wait()
+            self._changed.clear()
+            stream = self._subscribe(sorted(self.mints))
+            changed = asyncio.ensure_future(self._changed.wait())
+            next_trade = None
+            switch_at = None
+            try:
+                while switch_at is None or loop.time() < switch_at:
+                    if next_trade is None:
+                        next_trade = asyncio.ensure_future(anext(stream))
+                    if switch_at is None:
+                        await asyncio.wait((next_trade, changed), return_when=asyncio.FIRST_COMPLETED)
+                        if changed.done():
+                            # trades keep flowing from the current subscription while more watches may come in
+                            switch_at = loop.time() + STREAM_RESUBSCRIBE_DELAY
+                    else:
+                        await asyncio.wait((next_trade,), timeout=max(0.0, switch_at - loop.time()))
+                    if next_trade.done():
+                        try:
+                            trade = next_trade.result()
+                        except StopAsyncIteration:
+                            raise ConnectionError("trade stream closed by the server")
+                        next_trade = None
+                        yield trade
+            finally:
+                changed.cancel()
+                if next_trade is not None:
+                    next_trade.cancel()
+                    await asyncio.gather(next_trade, return_exceptions=True)
+                await stream.aclose()
+
+    async def _subscribe(self, mints: list):
+        headers = {"Authorization": self.api_key or BITQUERY_API_KEY}
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.endpoint, headers=headers, protocols=("graphql-transport-ws",), heartbeat=30) as ws:
+                await ws.send_json({"type": "connection_init", "payload": {}})
+                await ws.send_json({"id": "1", "type": "subscribe", "payload": {"query": SUBSCRIPTION, "variables": {"tokens": mints}}})
+                async for message in ws:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    data = message.json()
+                    if data.get("type") == "ping":
+                        await ws.send_json({"type": "pong"})
+                    elif data.get("type") == "error":
+                        raise ConnectionError(f"trade stream error: {data.get('payload')}")
+                    elif data.get("type") == "next":
+                        for row in data["payload"]["data"]["Solana"]["DEXTradeByTokens"]:
+                            yield {
+                                "time": _parse_time(row["Block"]["Time"]),
+                                "mint": row["Trade"]["Currency"]["MintAddress"],
+                                "name": row["Trade"]["Currency"].get("Name"),
+                                "symbol": row["Trade"]["Currency"].get("Symbol"),
+                                "signer": row["Transaction"]["Signer"],
+                                "side": row["Trade"]["Side"]["Type"],
+                                "amount_usd": float(row["Trade"]["Side"]["AmountInUSD"] or 0),
+                                "price_usd": float(row["Trade"]["PriceInUSD"] or 0),
+                            }
+
+
+class TradeStreamIngestor:
+    """Consumes a trade source and keeps a RollingWindow per watched mint"""
+
+    def __init__(self, source, window_seconds: float = WINDOW_SECONDS, idle_seconds: float = STREAM_IDLE_SECONDS):
+        self.source = source
+        self.window_seconds = window_seconds
+        self.idle_seconds = idle_seconds
+        self.windows = {}
+        self.watched_since = {}
+        self.last_used = {}
+        self.ingested = 0
+        self.restarts = 0
+        self._task = None
+
+    def watch(self, mint: str):
+        self.last_used[mint] = time.monotonic()
+        if mint not in self.watched_since:
+            self.watched_since[mint] = self.source.clock()
+            self.windows[mint] = RollingWindow(self.window_seconds)
+            self.source.watch(self.watched_since)
+
+    def unwatch(self, *mints: str):
+        for mint in mints:
+            self.watched_since.pop(mint, None)
+            self.windows.pop(mint, None)
+            self.last_used.pop(mint, None)
+        self.source.watch(self.watched_since)
+
+    def evict_idle(self) -> int:
+        """Unwatch the mints that have not been analyzed for idle_seconds, in a single resubscribe"""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [mint for mint, used in self.last_used.items() if used < cutoff]
+        if idle:
+            self.unwatch(*idle)
+            logger.info(f"Stopped streaming {len(idle)} idle mints")
+        return len(idle)
+
+    def mark_gap(self):
+        """Trades may have been missed, every window has to fill again before it is served"""
+        for mint in self.watched_since:
+            self.watched_since[mint] = None
+
+    def ingest(self, trade: dict):
+        window = self.windows.get(trade["mint"])
+        if window is None:
+            return
+        if self.watched_since[trade["mint"]] is None:
+            # the source had no clock yet when the mint was watched, start the window at its first trade
+            self.watched_since[trade["mint"]] = trade["time"]
+        window.add(trade)
+        self.ingested += 1
+
+    def is_warm(self, mint: str) -> bool:
+        """True once the mint has been watched for a full window without a gap, before that local metrics undercount"""
+        since = self.watched_since.get(mint)
+        now = self.source.clock()
+        return since is not None and now is not None and now - since >= self.window_seconds
+
+    def snapshot(self, mint: str):
+        """
+        Local metrics for a mint in Bitquery's response shape
+
+        Returns:
+            JSON text like a DEXTradeByTokens response, or None when the mint is not watched or not warm yet
+        """
+        if not self.is_warm(mint):
+            return None
+        self.last_used[mint] = time.monotonic()
+        window = self.windows[mint]
+        window.expire(self.source.clock())
+        rows = [window.snapshot()] if window.trades else []
+        return json.dumps({"data": {"Solana": {"DEXTradeByTokens": rows}}})
+
+    async def run(self):
+        """Ingest until the source ends, restarting it with backoff whenever it fails"""
+        delay = 1.0
+        while True:
+            ingested = self.ingested
+            try:
+                async for trade in self.source.trades():
+                    self.ingest(trade)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"Trade stream failed, restarting in {delay:.0f}s: {err!r}")
+            self.mark_gap()
+            self.restarts += 1
+            metrics.count("trade_stream.restarts")
+            if self.ingested > ingested:
+                delay = 1.0
+            await asyncio.sleep(delay)
+            delay = min(STREAM_MAX_RESTART_DELAY, delay * 2)
+            # windows start filling again from the reconnect (or the first trade when the source has no clock yet)
+            for mint in self.watched_since:
+                self.watched_since[mint] = self.source.clock()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "watched": len(self.watched_since),
+            "warm": sum(self.is_warm(mint) for mint in self.watched_since),
+            "ingested": self.ingested,
+            "restarts": self.restarts,
+        }
+
+
+def create_ingestor(mode: str = TRADE_STREAM_MODE):
+    """Build the ingestor configured by TRADE_STREAM_MODE, or None when streaming is off"""
+    if mode == "bitquery":
+        return TradeStreamIngestor(BitqueryStreamSource())
+    if mode.startswith("replay:"):
+        return TradeStreamIngestor(ReplayFileSource(mode[len("replay:"):]))
+    return None
+
+
+ingestor = create_ingestor()
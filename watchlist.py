@@ -0,0 +1,236 @@
+"""File Description
+
+    This module keeps a watchlist of mints per sender and scans all of them on a timer, so users get told when a token
+    moves instead of having to keep asking for analysis. Each refresh fetches every distinct watched mint once, through
+    the chunked batch query (a few dozen Bitquery requests for a thousand mints, with the metrics cache, the store and
+    the stale fallback in front of it), paced so it only spends the Bitquery budget above the reserve kept for
+    interactive analyses. It scores all of them in one vectorized pass and compares the result with the
+    previous refresh. An alert is raised only when a condition is crossed, i.e. it was false last time and is true now:
+    buy or sell pressure from the buyer/seller ratio, a volume spike against the mint's moving average, or the price
+    breaking above its 15m p99. Alerting on edges (plus a per-condition cooldown) keeps a token that stays hot from
+    paging its watchers every minute, and the LLM only runs for the mints that actually triggered.
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+
+import metrics
+from features import FEATURES, RAW, compute_features, metrics_matrix, parse_rows, score
+from query import get_memecoin_info_for_addresses
+
+logger = logging.getLogger(__name__)
+
+# seconds between watchlist refreshes
+WATCHLIST_INTERVAL = float(os.getenv("WATCHLIST_INTERVAL", 60))
+WATCHLIST_MAX_PER_SENDER = int(os.getenv("WATCHLIST_MAX_PER_SENDER", 50))
+# distinct mints across all senders; at 25 mints per batch query a full refresh is 40 Bitquery requests, a third of
+# the default BITQUERY_REQUESTS_PER_MINUTE per WATCHLIST_INTERVAL
+WATCHLIST_MAX_MINTS = int(os.getenv("WATCHLIST_MAX_MINTS", 1000))
+# alert thresholds: buyers/sellers ratio above HIGH or below LOW, 15m volume SPIKE times its moving average
+WATCHLIST_RATIO_HIGH = float(os.getenv("WATCHLIST_RATIO_HIGH", 2.0))
+WATCHLIST_RATIO_LOW = float(os.getenv("WATCHLIST_RATIO_LOW", 0.5))
+WATCHLIST_VOLUME_SPIKE = float(os.getenv("WATCHLIST_VOLUME_SPIKE", 3.0))
+# weight of the newest refresh in the volume moving average
+WATCHLIST_VOLUME_ALPHA = float(os.getenv("WATCHLIST_VOLUME_ALPHA", 0.2))
+# below these a token is too quiet for its ratios and spikes to mean anything
+WATCHLIST_MIN_TRADES = int(os.getenv("WATCHLIST_MIN_TRADES", 10))
+WATCHLIST_MIN_VOLUME = float(os.getenv("WATCHLIST_MIN_VOLUME", 1000))
+# seconds before the same condition can alert again for the same mint
+WATCHLIST_ALERT_COOLDOWN = float(os.getenv("WATCHLIST_ALERT_COOLDOWN", 900))
+# most triggered mints that get an LLM briefing per refresh, the rest are sent with the computed summary
+WATCHLIST_MAX_ANALYSES = int(os.getenv("WATCHLIST_MAX_ANALYSES", 20))
+WATCHLIST_STORAGE_KEY = "watchlists"
+
+CONDITIONS = ("buy_pressure", "sell_pressure", "volume_spike", "breakout")
+
+
+class WatchlistFull(Exception):
+    """Raised when a sender's watchlist or the agent-wide set of watched mints is at its limit"""
+
+
+class Watchlist:
+    def __init__(self, max_per_sender: int = WATCHLIST_MAX_PER_SENDER, max_mints: int = WATCHLIST_MAX_MINTS):
+        self.max_per_sender = max_per_sender
+        self.max_mints = max_mints
+        self.by_sender = {}
+        # reverse index, mint -> senders watching it, so a refresh fetches every mint once however many watch it
+        self.by_mint = {}
+        # per mint: conditions true at the last refresh, volume moving average, last alert time per condition
+        self.state = {}
+        self.refreshing = False
+        self.refreshes = 0
+        self.alerts = 0
+        self.last_duration = 0.0
+        self._dirty = False
+
+    def add(self, sender: str, mint: str) -> bool:
+        """
+        Returns:
+            False when the sender already watches the mint
+
+        Raises:
+            WatchlistFull: when the sender's list or the agent-wide mint set is full
+        """
+        mints = self.by_sender.get(sender, set())
+        if mint in mints:
+            return False
+        if len(mints) >= self.max_per_sender:
+            raise WatchlistFull(f"you can watch at most {self.max_per_sender} tokens")
+        if mint not in self.by_mint and len(self.by_mint) >= self.max_mints:
+            raise WatchlistFull("the watchlist scanner is at capacity")
+        self.by_sender.setdefault(sender, mints).add(mint)
+        self.by_mint.setdefault(mint, set()).add(sender)
+        self._dirty = True
+        return True
+
+    def remove(self, sender: str, mint: str) -> bool:
+        """Returns False when the sender was not watching the mint"""
+        mints = self.by_sender.get(sender, set())
+        if mint not in mints:
+            return False
+        mints.discard(mint)
+        if not mints:
+            del self.by_sender[sender]
+        watchers = self.by_mint[mint]
+        watchers.discard(sender)
+        if not watchers:
+            del self.by_mint[mint]
+            self.state.pop(mint, None)
+        self._dirty = True
+        return True
+
+    def mints(self, sender: str) -> list:
+        return sorted(self.by_sender.get(sender, ()))
+
+    def watchers(self, mint: str) -> list:
+        return sorted(self.by_mint.get(mint, ()))
+
+    def persist(self, storage):
+        """Write the watchlists to storage, if they changed since the last write (alert state is not kept)"""
+        if not self._dirty:
+            return
+        storage.set(WATCHLIST_STORAGE_KEY, {sender: sorted(mints) for sender, mints in self.by_sender.items()})
+        self._dirty = False
+
+    def restore(self, storage):
+        for sender, mints in (storage.get(WATCHLIST_STORAGE_KEY) or {}).items():
+            for mint in mints:
+                try:
+                    self.add(sender, mint)
+                except WatchlistFull:
+                    break
+        self._dirty = False
+
+    def evaluate(self, infos: dict, now: float = None) -> dict:
+        """
+        Update the per-mint state from fresh metrics and return the conditions that were crossed
+
+        Args:
+            infos: dict of mint -> token info text
+            now: time of the refresh, defaults to now
+
+        Returns:
+            Dict of mint -> {"conditions": {condition: description}, "score": safety score} for the mints that alert
+        """
+        now = time.time() if now is None else now
+        mints, rows = [], []
+        for mint, info in infos.items():
+            found = parse_rows(info)
+            if found:
+                mints.append(mint)
+                rows.append(found[0])
+        if not rows:
+            return {}
+
+        raw = metrics_matrix(rows)
+        features = compute_features(raw)
+        scores = score(raw, features)
+        volume = raw[:, RAW["volume"]]
+        ratio = features[:, FEATURES["buyer_seller_ratio"]]
+        end, p99 = raw[:, RAW["end"]], raw[:, RAW["p99"]]
+        baseline = np.array([self.state.get(mint, {}).get("volume", np.nan) for mint in mints])
+
+        active = raw[:, RAW["trades"]] >= WATCHLIST_MIN_TRADES
+        hits = np.column_stack((
+            active & (ratio >= WATCHLIST_RATIO_HIGH),
+            active & (ratio <= WATCHLIST_RATIO_LOW),
+            active & (volume >= WATCHLIST_MIN_VOLUME) & (volume >= WATCHLIST_VOLUME_SPIKE * baseline),
+            active & (p99 > 0) & (end > p99),
+        ))
+        averaged = np.where(np.isnan(baseline), volume, baseline + WATCHLIST_VOLUME_ALPHA * (volume - baseline))
+
+        triggered = {}
+        for i, mint in enumerate(mints):
+            now_active = {condition for condition, hit in zip(CONDITIONS, hits[i]) if hit}
+            state = self.state.get(mint)
+            if state is None:
+                # a mint's first refresh only records its state, otherwise every add would alert on the current one
+                self.state[mint] = {"active": now_active, "volume": float(averaged[i]), "alerted": {}}
+                continue
+            crossed = now_active - state["active"]
+            state["active"] = now_active
+            state["volume"] = float(averaged[i])
+            crossed = {c for c in crossed if now - state["alerted"].get(c, 0) >= WATCHLIST_ALERT_COOLDOWN}
+            if not crossed:
+                continue
+            for condition in crossed:
+                state["alerted"][condition] = now
+            descriptions = {
+                "buy_pressure": f"buy pressure, {ratio[i]:.2f} buyers per seller",
+                "sell_pressure": f"sell pressure, {ratio[i]:.2f} buyers per seller",
+                "volume_spike": f"volume spike, ${volume[i]:,.0f} in 15m against ~${baseline[i]:,.0f} usually",
+                "breakout": f"price ${end[i]:.10g} broke above its 15m p99 ${p99[i]:.10g}",
+            }
+            triggered[mint] = {
+                "conditions": {condition: descriptions[condition] for condition in CONDITIONS if condition in crossed},
+                "score": int(scores[i]),
+            }
+        return triggered
+
+    async def refresh(self) -> dict:
+        """
+        Fetch fresh metrics for every watched mint in batched queries and evaluate them
+
+        Returns:
+            Dict of mint -> {"conditions", "score", "info"} for the mints that crossed a threshold; empty while a
+            previous refresh is still running
+        """
+        if self.refreshing or not self.by_mint:
+            return {}
+        self.refreshing = True
+        started = time.monotonic()
+        try:
+            with metrics.span("watchlist_refresh"):
+                fetched = await get_memecoin_info_for_addresses(list(self.by_mint), paced=True)
+            infos = {mint: info for mint, info in fetched.items() if not isinstance(info, Exception)}
+            if len(infos) < len(fetched):
+                metrics.count("watchlist.fetch_failures", len(fetched) - len(infos))
+            triggered = self.evaluate(infos)
+            for mint, alert in triggered.items():
+                alert["info"] = infos[mint]
+            self.refreshes += 1
+            self.alerts += len(triggered)
+            return triggered
+        finally:
+            self.refreshing = False
+            self.last_duration = time.monotonic() - started
+
+    def alert_text(self, mint: str, alert: dict) -> str:
+        lines = [f"🔔 Watchlist alert for {mint} (safety score {alert['score']}/10):"]
+        lines += [f"- {description}" for description in alert["conditions"].values()]
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "senders": len(self.by_sender),
+            "mints": len(self.by_mint),
+            "refreshes": self.refreshes,
+            "alerts": self.alerts,
+            "last_refresh_s": round(self.last_duration, 2),
+        }
+
+
+watchlist = Watchlist()
@@ -0,0 +1,220 @@
+"""File Description
+
+    This module computes trading metrics for several timeframes (1m, 5m, 15m and 1h by default) from one list of raw
+    trades, so a single Bitquery fetch over the widest window replaces one aggregate query per timeframe. Trades are
+    turned into NumPy columns sorted by time; because every window ends "now", each window is just a suffix of those
+    columns found with a binary search, and counts, distinct signers, buy/sell volume, price quantiles and OHLC are
+    computed on that slice with array operations.
+"""
+
+import numpy as np
+
+# label -> window length in seconds
+WINDOWS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+
+
+def trades_to_arrays(trades: list) -> dict:
+    """
+    Column arrays for a list of trades, sorted by time
+
+    Args:
+        trades: dicts with "time" (ISO-8601 string or epoch seconds), "signer", "side", "amount_usd", "price_usd"
+    """
+    if not trades:
+        empty = np.zeros(0)
+        return {"time": empty, "price": empty, "amount": empty, "is_buy": empty.astype(bool), "signer": empty.astype(int)}
+
+    raw_times = [trade["time"] for trade in trades]
+    if isinstance(raw_times[0], str):
+        times = np.array([value.rstrip("Z") for value in raw_times], dtype="datetime64[ms]").astype(np.int64) / 1000.0
+    else:
+        times = np.asarray(raw_times, dtype=np.float64)
+    order = np.argsort(times, kind="stable")
+    # signers become small integer codes so distinct counts are np.unique over ints
+    _, signer_codes = np.unique(np.array([trade["signer"] for trade in trades]), return_inverse=True)
+
+    return {
+        "time": times[order],
+        "price": np.array([float(trade["price_usd"] or 0) for trade in trades])[order],
+        "amount": np.array([float(trade["amount_usd"] or 0) for trade in trades])[order],
+        "is_buy": np.array([trade["side"] == "buy" for trade in trades])[order],
+        "signer": signer_codes[order],
+    }
+
+
+def _distinct(codes: np.ndarray) -> int:
+    return int(np.unique(codes).size)
+
+
+def window_metrics(columns: dict, now: float, windows: dict = WINDOWS, complete_since: float = None) -> dict:
+    """
+    Metrics per window ending at `now`
+
+    Args:
+        columns: output of trades_to_arrays
+        now: end of every window, epoch seconds
+        windows: label -> length in seconds
+        complete_since: earliest time the trade list is known to be complete from (the fetch was truncated);
+            windows reaching further back are flagged "complete": False
+
+    Returns:
+        label -> dict of trades, buys, sells, makers, buyers, sellers, volume, buy_volume, sell_volume,
+        open, high, low, close, p50 and p99 price
+    """
+    times = columns["time"]
+    results = {}
+    for label, seconds in windows.items():
+        start = np.searchsorted(times, now - seconds, side="left")
+        end = np.searchsorted(times, now, side="right")
+        price = columns["price"][start:end]
+        amount = columns["amount"][start:end]
+        is_buy = columns["is_buy"][start:end]
+        signer = columns["signer"][start:end]
+        priced = price[price > 0]
+
+        results[label] = {
+            "trades": int(end - start),
+            "buys": int(is_buy.sum()),
+            "sells": int((~is_buy).sum()),
+            "makers": _distinct(signer),
+            "buyers": _distinct(signer[is_buy]),
+            "sellers": _distinct(signer[~is_buy]),
+            "volume": float(amount.sum()),
+            "buy_volume": float(amount[is_buy].sum()),
+            "sell_volume": float(amount[~is_buy].sum()),
+            "open": float(priced[0]) if priced.size else None,
+            "high": float(priced.max()) if priced.size else None,
+            "low": float(priced.min()) if priced.size else None,
+            "close": float(priced[-1]) if priced.size else None,
+            "p50": float(np.quantile(priced, 0.50)) if priced.size else None,
+            "p99": float(np.quantile(priced, 0.99)) if priced.size else None,
+            "complete": complete_since is None or complete_since <= now - seconds,
+        }
+    return results
+
+
+def to_bitquery_row(metrics: dict, currency: dict) -> dict:
+    """One window's metrics as a DEXTradeByTokens row with the 15 minute query's aliases"""
+    return {
+        "Trade": {"Currency": currency, "start": metrics["open"], "end": metrics["close"]},
+        "makers_15min": str(metrics["makers"]),
+        "buyers_15min": str(metrics["buyers"]),
+        "sellers_15min": str(metrics["sellers"]),
+        "trades_15min": str(metrics["trades"]),
+        "traded_volume_15min": str(metrics["volume"]),
+        "buy_volume_15min": str(metrics["buy_volume"]),
+        "sell_volume_15min": str(metrics["sell_volume"]),
+        "buys_15min": str(metrics["buys"]),
+        "sells_15min": str(metrics["sells"]),
+        "price_15min_allTimeHigh": metrics["p99"],
+    }
+
+
+def summarize_windows(windows: dict) -> str:
+    """Compact one-line-per-timeframe table for the analysis prompt"""
+    lines = ["Timeframes (trades, buys/sells, makers, volume $, buy share, open -> close, high/low, p99):"]
+    for label, m in windows.items():
+        if not m["trades"]:
+            lines.append(f"{label}: no trades")
+            continue
+        change = (m["close"] - m["open"]) / m["open"] if m["open"] else 0.0
+        buy_share = m["buy_volume"] / m["volume"] if m["volume"] else 0.0
+        lines.append(
+            f"{label}: {m['trades']} trades, {m['buys']}/{m['sells']}, {m['makers']} makers, ${m['volume']:,.0f}, "
+            f"{buy_share:.0%} buys, ${m['open']:.10g} -> ${m['close']:.10g} ({change:+.1%}), "
+            f"${m['high']:.10g}/${m['low']:.10g}, p99 ${m['p99']:.10g}"
+            + ("" if m["complete"] else " (partial, trade fetch truncated)")
+        )
+    return "\n".join(lines)
+
+
+def _window_bounds(times: np.ndarray, ends: np.ndarray, seconds: float):
+    return np.searchsorted(times, ends - seconds, side="left"), np.searchsorted(times, ends, side="right")
+
+
+def _distinct_in_windows(codes: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """
+    Distinct codes in every slice codes[low[k]:high[k]], with low and high non-decreasing
+
+    A trade repeats its signer inside window k when the signer's previous trade is in the window too, i.e. when
+    low[k] <= prev and index < high[k]. Both bounds are monotone, so each repeat counts in one contiguous run of
+    windows, and all runs are added up at once with a difference array.
+    """
+    repeats = np.zeros(len(low) + 1, dtype=np.int64)
+    if len(codes):
+        order = np.lexsort((np.arange(len(codes)), codes))
+        same = codes[order][1:] == codes[order][:-1]
+        index, prev = order[1:][same], order[:-1][same]
+        first = np.searchsorted(high, index, side="right")
+        last = np.searchsorted(low, prev, side="right") - 1
+        counted = first <= last
+        np.add.at(repeats, first[counted], 1)
+        np.add.at(repeats, last[counted] + 1, -1)
+    return (high - low) - np.cumsum(repeats)[:-1]
+
+
+def _range_max(values: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """max(values[low[k]:high[k]]) for every k (0 for empty slices), from a sparse table of power-of-two maxima"""
+    result = np.zeros(len(low))
+    length = high - low
+    nonempty = length > 0
+    if not nonempty.any():
+        return result
+    levels = [np.asarray(values, dtype=np.float64)]
+    while 2 ** len(levels) <= len(values):
+        half = 2 ** (len(levels) - 1)
+        levels.append(np.maximum(levels[-1][:-half], levels[-1][half:]))
+    level = np.zeros(len(low), dtype=np.int64)
+    level[nonempty] = np.floor(np.log2(length[nonempty])).astype(np.int64)
+    for k in np.unique(level[nonempty]):
+        selected = nonempty & (level == k)
+        table = levels[k]
+        result[selected] = np.maximum(table[low[selected]], table[high[selected] - 2 ** k])
+    return result
+
+
+def sliding_metrics(columns: dict, ends: np.ndarray, seconds: float) -> dict:
+    """
+    The 15m query's metrics for a window of `seconds` ending at each of many times, all at once
+
+    Used to replay history (backtests) where window_metrics would be called thousands of times per mint. Sums come
+    from cumulative sums, distinct signers from _distinct_in_windows; the p99 price is approximated by the window's
+    high, which is what it converges to on thin windows.
+
+    Args:
+        columns: output of trades_to_arrays (or TokenStore.trade_columns), trades without a price removed
+        ends: window end times, ascending
+        seconds: window length
+
+    Returns:
+        Dict keyed like features.RAW_FIELDS, one array per metric with len(ends) values
+    """
+    ends = np.asarray(ends, dtype=np.float64)
+    low, high = _window_bounds(columns["time"], ends, seconds)
+    price, amount, is_buy, signer = columns["price"], columns["amount"], columns["is_buy"], columns["signer"]
+    nonempty = high > low
+
+    def window_sum(values):
+        cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+        return cumulative[high] - cumulative[low]
+
+    buy_index = np.nonzero(is_buy)[0]
+    sell_index = np.nonzero(~is_buy)[0]
+    buy_low, buy_high = np.searchsorted(buy_index, low), np.searchsorted(buy_index, high)
+    sell_low, sell_high = np.searchsorted(sell_index, low), np.searchsorted(sell_index, high)
+    buy_amount = np.where(is_buy, amount, 0.0)
+
+    return {
+        "start": np.where(nonempty, price[np.minimum(low, len(price) - 1)] if len(price) else 0.0, 0.0),
+        "end": np.where(nonempty, price[np.maximum(high - 1, 0)] if len(price) else 0.0, 0.0),
+        "p99": _range_max(price, low, high),
+        "makers": _distinct_in_windows(signer, low, high),
+        "buyers": _distinct_in_windows(signer[buy_index], buy_low, buy_high),
+        "sellers": _distinct_in_windows(signer[sell_index], sell_low, sell_high),
+        "trades": high - low,
+        "buys": buy_high - buy_low,
+        "sells": sell_high - sell_low,
+        "volume": window_sum(amount),
+        "buy_volume": window_sum(buy_amount),
+        "sell_volume": window_sum(amount - buy_amount),
+    }
@@ -0,0 +1,319 @@
+"""File Description
+
+    This module is the optional multi-process mode. With WORKER_PROCESSES > 0 the uAgents process receives messages,
+    parses intents, schedules jobs, places trades and answers multi-token analyses (their mints belong to different
+    workers), while single-token analyses run in N local worker processes, so Bitquery parsing, scoring, LLM calls and
+    reply formatting spread over several cores under one agent identity. Trades stay in the agent process so one
+    wallet's orders are still sent one at a time, and every process spends an equal share of the upstream rate limits
+    (see ratelimit.UPSTREAM_BUDGET_SHARE).
+    Each worker is this file run as a child process: jobs go to it as JSON lines on its stdin and the ChatMessages it
+    would have sent come back on its stdout, where the front end forwards them to the sender. A job is routed by a
+    stable hash of its mint address, so every request for a mint lands on the same worker and finds that worker's
+    metrics cache and analysis cache warm. Workers report their queue and metrics in a
+    heartbeat, and a worker that exits is restarted with backoff while its unfinished jobs fail with WorkerUnavailable.
+"""
+
+import asyncio
+import builtins
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+
+from uagents_core.contrib.protocols.chat import ChatMessage
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# worker processes for analyses, 0 runs everything in the agent process
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 0))
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", 10))
+# a worker that has not sent a heartbeat for this long is reported unhealthy
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", 30))
+WORKER_MAX_RESTART_DELAY = float(os.getenv("WORKER_MAX_RESTART_DELAY", 30))
+# secrets Agentverse injects as builtins; workers get them on stdin rather than in their environment
+SECRET_NAMES = ("AGENTVERSE_API_KEY", "BITQUERY_API_KEY", "PUMP_PORTAL_API_KEY")
+# longest protocol line, a message carries a whole briefing
+LINE_LIMIT = 2 ** 22
+
+
+class WorkerUnavailable(Exception):
+    """Raised for a job whose worker is not running or exited before finishing it"""
+
+
+def shard(address: str, shards: int) -> int:
+    """Worker index of a mint; crc32 instead of hash(), which changes from one run to the next"""
+    return zlib.crc32(address.encode()) % shards
+
+
+class _Job:
+    """A job in flight on a worker; its messages are sent in the order the worker produced them"""
+
+    def __init__(self, send):
+        self.send = send
+        self.done = asyncio.get_running_loop().create_future()
+        self.last = None
+
+    def deliver(self, message):
+        self.last = asyncio.ensure_future(self._send_after(self.last, message))
+
+    async def _send_after(self, previous, message):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await self.send(message)
+
+
+class WorkerProcess:
+    """The front end's handle on one worker process"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.jobs = {}
+        self.started_at = None
+        self.last_heartbeat = None
+        self.report = {}
+        self.restarts = 0
+        self.completed = 0
+        self.failed = 0
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self):
+        self.started_at = time.monotonic()
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), str(self.index),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=LINE_LIMIT,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        self.last_heartbeat = time.monotonic()
+        secrets = {name: getattr(builtins, name) for name in SECRET_NAMES if hasattr(builtins, name)}
+        await self.write({"type": "init", "secrets": secrets})
+
+    async def write(self, message: dict):
+        self.process.stdin.write(json.dumps(message).encode() + b"\n")
+        await self.process.stdin.drain()
+
+    def fail_pending(self):
+        for job in self.jobs.values():
+            if not job.done.done():
+                job.done.set_exception(WorkerUnavailable(f"worker {self.index} exited"))
+        self.failed += len(self.jobs)
+        self.jobs = {}
+
+    def stats(self) -> dict:
+        heartbeat_age = time.monotonic() - self.last_heartbeat if self.last_heartbeat is not None else None
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive(),
+            "healthy": self.alive() and heartbeat_age is not None and heartbeat_age < WORKER_HEARTBEAT_TIMEOUT,
+            "heartbeat_age_s": round(heartbeat_age, 1) if heartbeat_age is not None else None,
+            "in_flight": len(self.jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "metrics": self.report,
+        }
+
+
+class WorkerPool:
+    def __init__(self, processes: int = WORKER_PROCESSES):
+        self.workers = [WorkerProcess(index) for index in range(processes)]
+        self._supervisors = []
+        self._next_id = 0
+        self._stopping = False
+
+    def start(self):
+        if not self._supervisors:
+            self._supervisors = [asyncio.ensure_future(self._supervise(worker)) for worker in self.workers]
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self.workers:
+            if worker.alive():
+                # closing stdin lets the worker finish its jobs in flight and exit
+                worker.process.stdin.close()
+        for worker in self.workers:
+            if worker.alive():
+                try:
+                    await asyncio.wait_for(worker.process.wait(), 10)
+                except asyncio.TimeoutError:
+                    worker.process.kill()
+        for supervisor in self._supervisors:
+            supervisor.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        self._supervisors = []
+
+    async def _supervise(self, worker: WorkerProcess):
+        """Keep one worker running, restarting it with exponential backoff when it exits"""
+        delay = 1.0
+        while not self._stopping:
+            try:
+                await worker.spawn()
+                logger.info(f"Worker {worker.index} started (pid {worker.process.pid})")
+                await self._read(worker)
+                await worker.process.wait()
+            except Exception as err:
+                logger.error(f"Worker {worker.index} failed: {err!r}")
+            worker.fail_pending()
+            if self._stopping:
+                break
+            if worker.alive():
+                worker.process.kill()
+            if time.monotonic() - worker.started_at > 60:
+                delay = 1.0
+            worker.restarts += 1
+            metrics.count("workers.restarts")
+            logger.warning(f"Worker {worker.index} exited, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(WORKER_MAX_RESTART_DELAY, delay * 2)
+
+    async def _read(self, worker: WorkerProcess):
+        async for line in worker.process.stdout:
+            message = json.loads(line)
+            if message["type"] == "heartbeat":
+                worker.last_heartbeat = time.monotonic()
+                worker.report = message["stats"]
+                continue
+            job = worker.jobs.get(message["id"])
+            if job is None:
+                continue
+            if message["type"] == "send":
+                job.deliver(ChatMessage.parse_raw(message["message"]))
+            elif message["type"] == "done":
+                del worker.jobs[message["id"]]
+                worker.completed += 1
+                job.done.set_result(message.get("error"))
+
+    async def run(self, send, sender: str, data: dict, text: str, key: str, received_at: float):
+        """
+        Run a parsed analysis command on the worker that owns its mint
+
+        Args:
+            send: coroutine function that delivers a ChatMessage to the sender
+            sender, data, text, key, received_at: as for chat.run_command
+
+        Raises:
+            WorkerUnavailable: when the worker is down or exits before finishing the job
+        """
+        worker = self.workers[shard(data["address"], len(self.workers))]
+        if not worker.alive():
+            raise WorkerUnavailable(f"worker {worker.index} is not running")
+        self._next_id += 1
+        job_id = self._next_id
+        job = worker.jobs[job_id] = _Job(send)
+        try:
+            await worker.write({
+                "type": "job", "id": job_id, "sender": sender, "data": data, "text": text, "key": key,
+                "received_at": received_at,
+            })
+        except (ConnectionError, RuntimeError) as err:
+            worker.jobs.pop(job_id, None)
+            raise WorkerUnavailable(f"worker {worker.index} is not accepting jobs: {err!r}") from err
+        try:
+            await job.done
+        finally:
+            if job.last is not None:
+                await asyncio.gather(job.last, return_exceptions=True)
+
+    def depth(self) -> int:
+        return sum(len(worker.jobs) for worker in self.workers)
+
+    def stats(self) -> dict:
+        return {
+            "processes": len(self.workers),
+            "alive": sum(worker.alive() for worker in self.workers),
+            "in_flight": self.depth(),
+            "workers": {worker.index: worker.stats() for worker in self.workers},
+        }
+
+
+worker_pool = WorkerPool() if WORKER_PROCESSES > 0 else None
+
+
+class _WorkerContext:
+    """Stands in for the uAgents Context inside a worker: sends go back to the front end instead of out"""
+
+    logger = logging.getLogger("worker")
+
+    def __init__(self, job_id: int, write):
+        self.job_id = job_id
+        self.write = write
+
+    async def send(self, destination: str, message):
+        self.write({"type": "send", "id": self.job_id, "message": message.json()})
+
+
+async def _run_job(run_command, message: dict, write):
+    error = None
+    try:
+        await run_command(
+            _WorkerContext(message["id"], write), message["sender"], message["data"], message["text"],
+            message["key"], message["received_at"],
+        )
+    except Exception as err:
+        logger.error(f"Job {message['id']} failed: {err}")
+        error = str(err)
+    write({"type": "done", "id": message["id"], "error": error})
+
+
+async def _heartbeat(index: int, jobs: set, write, ingestor=None):
+    while True:
+        write({"type": "heartbeat", "stats": {"index": index, "pid": os.getpid(), "jobs": len(jobs), **metrics.snapshot()}})
+        if ingestor is not None:
+            ingestor.evict_idle()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+async def serve(index: int):
+    """Worker main loop: run jobs from stdin concurrently until the front end closes it"""
+    # the protocol keeps the real stdout, anything printed goes to stderr with the logs
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+
+    def write(message: dict):
+        out.write(json.dumps(message, default=str).encode() + b"\n")
+        out.flush()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    init = json.loads(await reader.readline())
+    for name, value in init["secrets"].items():
+        setattr(builtins, name, value)
+    # imported only now, these modules read the secrets at import time
+    from chat import run_command
+    from helpers import analysis_cache
+    from http_client import close_all
+    import query
+    import trade_stream
+
+    metrics.register_source("metrics_cache", query.metrics_cache.stats)
+    metrics.register_source("analysis_cache", analysis_cache.stats)
+    if trade_stream.ingestor is not None:
+        trade_stream.ingestor.start()
+        metrics.register_source("trade_stream", trade_stream.ingestor.stats)
+
+    jobs = set()
+    heartbeat = asyncio.ensure_future(_heartbeat(index, jobs, write, trade_stream.ingestor))
+    while line := await reader.readline():
+        job = asyncio.ensure_future(_run_job(run_command, json.loads(line), write))
+        jobs.add(job)
+        job.add_done_callback(jobs.discard)
+
+    # stdin closed: the agent is stopping, finish what is in flight
+    await asyncio.gather(*jobs, return_exceptions=True)
+    heartbeat.cancel()
+    if trade_stream.ingestor is not None:
+        await trade_stream.ingestor.stop()
+    await close_all()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=f"worker {sys.argv[1]} %(levelname)s %(name)s: %(message)s")
+    asyncio.run(serve(int(sys.argv[1])))